@@ -0,0 +1,134 @@
+import sys
+import time
+
+import numpy as np
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+
+def _assign(vectors, centroids, chunk=65536):
+    """Index of the most similar centroid for every row, in chunks"""
+    labels = np.empty(len(vectors), dtype=np.intp)
+    for start in range(0, len(vectors), chunk):
+        block = vectors[start:start + chunk]
+        labels[start:start + chunk] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+class IVFIndex:
+    """Inverted-file coarse quantizer (spherical k-means) over row vectors.
+
+    candidates() returns the ids stored in the n_probe lists whose
+    centroids are closest to the query; callers re-score those exactly.
+    """
+
+    def __init__(self, vectors, n_lists=None, n_probe=8, n_iter=10, seed=0, train_size=None):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        n = len(vectors)
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(n)))
+        n_lists = max(1, min(n_lists, n))
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+
+        rng = np.random.default_rng(seed)
+        train_size = train_size or min(n, max(64 * n_lists, 10000))
+        train = vectors[rng.choice(n, size=train_size, replace=False)] if n else vectors
+        centroids = train[rng.choice(len(train), size=n_lists, replace=False)] if n else train
+        for _ in range(n_iter):
+            labels = _assign(train, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, train)
+            empty = np.bincount(labels, minlength=n_lists) == 0
+            # 空簇重新随机取一个训练点作为中心
+            sums[empty] = train[rng.choice(len(train), size=int(empty.sum()))]
+            centroids = _normalize(sums)
+        self.centroids = centroids
+
+        labels = _assign(vectors, centroids) if n else np.empty(0, dtype=np.intp)
+        self.ids = np.argsort(labels, kind='stable').astype(np.intp)
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=n_lists))])
+
+    def members(self, list_id):
+        return self.ids[self.offsets[list_id]:self.offsets[list_id + 1]]
+
+    def candidates(self, query, n_probe=None, allowed=None):
+        """Sorted ids in the lists nearest to query.
+
+        allowed is an optional boolean mask: only allowed ids are returned,
+        and further lists are probed, nearest first, until as many ids as
+        the n_probe nearest lists hold have been collected (or every list
+        has been probed), so a selective filter does not starve the pool.
+        """
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        sims = self.centroids @ np.asarray(query, dtype=np.float32).ravel()
+        if allowed is None:
+            lists = np.argpartition(-sims, n_probe - 1)[:n_probe]
+            ids = np.concatenate([self.members(c) for c in lists])
+            ids.sort()
+            return ids
+        order = np.argsort(-sims)
+        target = sum(len(self.members(c)) for c in order[:n_probe])
+        chunks, found = [], 0
+        for probed, list_id in enumerate(order, 1):
+            ids = self.members(list_id)
+            ids = ids[allowed[ids]]
+            chunks.append(ids)
+            found += len(ids)
+            if probed >= n_probe and found >= target:
+                break
+        ids = np.concatenate(chunks)
+        ids.sort()
+        return ids
+
+
+def synthetic_vectors(n, dim=384, n_topics=1024, noise=1.5, seed=0):
+    """Clustered unit vectors, a rough stand-in for sentence embeddings"""
+    rng = np.random.default_rng(seed)
+    topics = _normalize(rng.standard_normal((n_topics, dim)))
+    vectors = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, 65536):
+        size = min(65536, n - start)
+        block = topics[rng.integers(n_topics, size=size)]
+        block += noise * rng.standard_normal((size, dim)).astype(np.float32) / np.sqrt(dim)
+        vectors[start:start + size] = _normalize(block)
+    return vectors
+
+
+def benchmark(sizes=(10000, 100000, 1000000), k=3, n_queries=200, n_probes=(8, 16, 32), dim=384, seed=0):
+    """Print recall@k and per-query latency of IVF vs exact scan"""
+    print(f"{'n':>9} {'lists':>6} {'probe':>5} {'build s':>8} {'exact ms':>9} {'ivf ms':>7} {'recall@' + str(k):>9}")
+    for n in sizes:
+        # 查询与语料来自同一组主题
+        vectors = synthetic_vectors(n + n_queries, dim=dim, seed=seed)
+        vectors, queries = vectors[:n], vectors[n:]
+
+        start = time.perf_counter()
+        index = IVFIndex(vectors, seed=seed)
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        exact = [set(np.argpartition(-(vectors @ q), k - 1)[:k]) for q in queries]
+        exact_ms = (time.perf_counter() - start) * 1000 / n_queries
+
+        for n_probe in n_probes:
+            start = time.perf_counter()
+            approx = []
+            for q in queries:
+                ids = index.candidates(q, n_probe)
+                scores = vectors[ids] @ q
+                top = min(k, len(ids))
+                approx.append(set(ids[np.argpartition(-scores, top - 1)[:top]]))
+            ivf_ms = (time.perf_counter() - start) * 1000 / n_queries
+
+            recall = np.mean([len(a & e) / k for a, e in zip(approx, exact)])
+            print(f"{n:>9} {index.n_lists:>6} {n_probe:>5} {build:>8.2f} {exact_ms:>9.3f} {ivf_ms:>7.3f} {recall:>9.3f}")
+
+
+if __name__ == '__main__':
+    # 用法: python src/test/ann.py [n1 n2 ...]
+    benchmark(tuple(int(arg) for arg in sys.argv[1:]) or (10000, 100000, 1000000))
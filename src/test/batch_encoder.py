@@ -0,0 +1,116 @@
+import sys
+import time
+
+import numpy as np
+
+
+class BatchEncoder:
+    """Embedder wrapper that encodes large lists in length-sorted batches.
+
+    Texts are sorted by length so each batch pads to similar lengths, then
+    encoded batch_size at a time and put back in input order. With
+    processes > 1 and a SentenceTransformer, the batches are spread over a
+    CPU multi-process pool instead. Throughput of the last call is kept in
+    last_count / last_seconds.
+    """
+
+    def __init__(self, embedder, batch_size=32, processes=0):
+        if batch_size < 1:
+            raise ValueError("batch_size must be >= 1")
+        self.embedder = embedder
+        self.batch_size = batch_size
+        self.processes = processes
+        self._pool = None
+        self.last_count = 0
+        self.last_seconds = 0.0
+
+    @property
+    def rate(self):
+        """Texts per second of the last encode() call"""
+        return self.last_count / self.last_seconds if self.last_seconds else 0.0
+
+    def _start_pool(self):
+        if self._pool is None:
+            # 多进程池由 sentence_transformers 管理, 每个进程各加载一份模型
+            self._pool = self.embedder.start_multi_process_pool(target_devices=['cpu'] * self.processes)
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self.embedder.stop_multi_process_pool(self._pool)
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _use_pool(self):
+        return self.processes > 1 and hasattr(self.embedder, 'start_multi_process_pool')
+
+    def encode(self, sentences, convert_to_numpy=True, normalize_embeddings=False, **kwargs):
+        if isinstance(sentences, str):
+            return self.embedder.encode(sentences, convert_to_numpy=True,
+                                        normalize_embeddings=normalize_embeddings, **kwargs)
+        sentences = list(sentences)
+        kwargs.pop('batch_size', None)
+        start = time.perf_counter()
+        # 按长度从长到短排序, 同一批内补齐的 padding 最少
+        order = sorted(range(len(sentences)), key=lambda i: -len(sentences[i]))
+        ordered = [sentences[i] for i in order]
+        if not ordered:
+            embeddings = np.zeros((0, 0), dtype=np.float32)
+        elif self._use_pool():
+            embeddings = self.embedder.encode_multi_process(
+                ordered, self._start_pool(), batch_size=self.batch_size,
+                normalize_embeddings=normalize_embeddings,
+            )
+        else:
+            batches = [
+                self.embedder.encode(ordered[i:i + self.batch_size], convert_to_numpy=True,
+                                     batch_size=self.batch_size, normalize_embeddings=normalize_embeddings,
+                                     **kwargs)
+                for i in range(0, len(ordered), self.batch_size)
+            ]
+            embeddings = np.concatenate(batches)
+        result = np.empty_like(np.asarray(embeddings, dtype=np.float32))
+        result[order] = embeddings
+        self.last_count = len(sentences)
+        self.last_seconds = time.perf_counter() - start
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.embedder, name)
+
+
+def benchmark(batch_sizes=(1, 8, 32, 64), processes=0):
+    """Compare recipes/s and vectors of the per-recipe loop and batched encoding"""
+    import json
+
+    from recipe_store import document_text
+    from search_function import RECIPES_PATH, get_embedder
+
+    with open(RECIPES_PATH, encoding="utf-8") as f:
+        texts = [document_text(recipe) for recipe in json.load(f)]
+    embedder = get_embedder()
+
+    start = time.perf_counter()
+    reference = np.array([embedder.encode(text, convert_to_numpy=True) for text in texts], dtype=np.float32)
+    seconds = time.perf_counter() - start
+    print(f"{'mode':>14} {'recipes/s':>10} {'max |diff|':>11}")
+    print(f"{'per-recipe':>14} {len(texts) / seconds:>10.1f} {0.0:>11.2e}")
+    configs = [(size, 0) for size in batch_sizes]
+    if processes > 1:
+        configs.append((max(batch_sizes), processes))
+    for batch_size, n_proc in configs:
+        with BatchEncoder(embedder, batch_size=batch_size, processes=n_proc) as encoder:
+            embeddings = encoder.encode(texts)
+            label = f"batch {batch_size}" + (f" x{n_proc}p" if n_proc > 1 else '')
+            diff = np.abs(embeddings - reference).max()
+            print(f"{label:>14} {encoder.rate:>10.1f} {diff:>11.2e}")
+
+
+if __name__ == '__main__':
+    # 用法: python src/test/batch_encoder.py [processes]
+    benchmark(processes=int(sys.argv[1]) if len(sys.argv) > 1 else 0)
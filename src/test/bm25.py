@@ -0,0 +1,75 @@
+import re
+from collections import Counter
+
+import numpy as np
+
+# BM25 使用的食谱字段
+BM25_FIELDS = ['title', 'ingredients', 'instructions', 'notes']
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def recipe_text(recipe, fields=BM25_FIELDS):
+    """Concatenate the BM25 fields of a recipe dict"""
+    return '\n'.join(str(recipe.get(field) or '') for field in fields)
+
+
+class BM25Index:
+    """Okapi BM25 over a term-major CSR matrix of precomputed term weights.
+
+    Row t of (indptr, indices, data) lists the documents containing term t
+    and that term's full BM25 contribution in each of them, so scoring a
+    query is a handful of sparse scatter-adds.
+    """
+
+    def __init__(self, documents, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        counts = [Counter(tokenize(doc)) for doc in documents]
+        self.n_docs = len(counts)
+        self.vocab = {}
+
+        term_ids, doc_ids, tfs = [], [], []
+        for doc_id, counter in enumerate(counts):
+            for term, tf in counter.items():
+                term_ids.append(self.vocab.setdefault(term, len(self.vocab)))
+                doc_ids.append(doc_id)
+                tfs.append(tf)
+        term_ids = np.array(term_ids, dtype=np.intp)
+        doc_ids = np.array(doc_ids, dtype=np.intp)
+        tfs = np.array(tfs, dtype=np.float64)
+
+        doc_len = np.array([sum(c.values()) for c in counts], dtype=np.float64)
+        avgdl = doc_len.mean() if self.n_docs and doc_len.mean() > 0 else 1.0
+        df = np.bincount(term_ids, minlength=len(self.vocab))
+        idf = np.log(1.0 + (self.n_docs - df + 0.5) / (df + 0.5))
+
+        order = np.argsort(term_ids, kind='stable')
+        term_ids, doc_ids, tfs = term_ids[order], doc_ids[order], tfs[order]
+        self.indptr = np.concatenate([[0], np.cumsum(df)]).astype(np.intp)
+        self.indices = doc_ids
+        length_norm = k1 * (1.0 - b + b * doc_len[doc_ids] / avgdl)
+        self.data = idf[term_ids] * tfs * (k1 + 1.0) / (tfs + length_norm)
+
+    @classmethod
+    def from_recipes(cls, recipes, fields=BM25_FIELDS, **kwargs):
+        return cls([recipe_text(recipe, fields) for recipe in recipes], **kwargs)
+
+    def __len__(self):
+        return self.n_docs
+
+    def scores(self, query):
+        """BM25 score of every document for query (zeros where no term matches)"""
+        scores = np.zeros(self.n_docs, dtype=np.float64)
+        for term in set(tokenize(query)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            # 同一词的倒排表中文档不重复, 可以直接花式索引累加
+            scores[self.indices[start:end]] += self.data[start:end]
+        return scores
@@ -0,0 +1,154 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def model_name(embedder):
+    """Stable name of an embedder, for keys that outlive the process; raises ValueError if it has none"""
+    name = getattr(embedder, 'name', None)
+    if isinstance(name, str) and name:
+        return name
+    card = getattr(embedder, 'model_card_data', None)
+    base_model = getattr(card, 'base_model', None)
+    if base_model:
+        return base_model
+    raise ValueError(f"{type(embedder).__name__} has no stable model name; set its .name or pass model=")
+
+
+def model_key(embedder):
+    """In-process cache key of an embedder: its model name, or its identity when it has none"""
+    try:
+        return model_name(embedder)
+    except ValueError:
+        # 只用于进程内缓存: 不同的匿名模型不会共用缓存项
+        return f"{type(embedder).__name__}@{id(embedder):x}"
+
+
+def model_revision(embedder):
+    """Best-effort revision (e.g. the Hugging Face commit hash) of an embedder's weights, or ''"""
+    revision = getattr(embedder, 'revision', None)
+    if isinstance(revision, str) and revision:
+        return revision
+    card = getattr(embedder, 'model_card_data', None)
+    revision = getattr(card, 'base_model_revision', None)
+    if revision:
+        return revision
+    # SentenceTransformer 的第一个模块是 transformers 模型, 配置里记录了下载时的 commit
+    first_module = getattr(embedder, '_first_module', None)
+    if callable(first_module):
+        config = getattr(getattr(first_module(), 'auto_model', None), 'config', None)
+        revision = getattr(config, '_commit_hash', None)
+        if revision:
+            return revision
+    return ''
+
+
+def normalize_query(base_query):
+    """Cache-key form of a base query: lower case, single spaces"""
+    return ' '.join(base_query.lower().split())
+
+
+class LRUCache:
+    """Bounded, thread-safe LRU mapping with hit/miss/eviction counters"""
+
+    def __init__(self, capacity=1024):
+        if capacity < 0:
+            raise ValueError("capacity must be >= 0")
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.capacity == 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+class QueryEmbeddingCache(LRUCache):
+    """LRU cache of query embeddings keyed by (model name, normalized query)"""
+
+    def put(self, key, embedding):
+        embedding = np.array(embedding, dtype=np.float32)
+        embedding.setflags(write=False)
+        super().put(key, embedding)
+
+    def encode(self, embedder, base_queries):
+        """Embeddings for base_queries, encoding only the cache misses in one batch"""
+        if not base_queries:
+            return np.empty((0, 0), dtype=np.float32)
+        name = model_key(embedder)
+        keys = [(name, normalize_query(q)) for q in base_queries]
+        found = [self.get(key) for key in keys]
+        missing = sorted({key[1] for key, emb in zip(keys, found) if emb is None})
+        if missing:
+            encoded = embedder.encode(missing, convert_to_numpy=True)
+            fresh = dict(zip(missing, encoded))
+            for text, embedding in fresh.items():
+                self.put((name, text), embedding)
+            found = [emb if emb is not None else fresh[key[1]] for key, emb in zip(keys, found)]
+        return np.array(found, dtype=np.float32).reshape(len(keys), -1)
+
+
+class SearchResultCache(LRUCache):
+    """LRU cache of final search() results, including 'No matching documents!'.
+
+    Keys carry the index version, so entries for a rebuilt or mutated
+    vector_store can never be hit again and simply age out.
+    """
+
+    @staticmethod
+    def make_key(embedder, query, k, min_similarity, version, filters=None):
+        # 只做小写化: 空白会影响属性后缀的解析, 不能随意合并
+        return (model_key(embedder), query.lower(), k, min_similarity, version, filters)
+
+    def get(self, key):
+        results = super().get(key)
+        return list(results) if results is not None else None
+
+    def put(self, key, results):
+        super().put(key, tuple(results))
+
+
+# 进程内默认的查询向量缓存和结果缓存
+query_embedding_cache = QueryEmbeddingCache()
+search_result_cache = SearchResultCache(capacity=4096)
@@ -0,0 +1,171 @@
+import heapq
+import secrets
+import sys
+import threading
+import time
+
+import numpy as np
+
+from caches import LRUCache
+from engine import MISSING, NO_MATCH, format_results, get_engine, index_version, parse_query
+
+# 每个游标最多保留的候选数, 以及进程内同时存活的游标数
+MAX_CANDIDATES = 1000
+MAX_CURSORS = 256
+
+
+class SearchCursor:
+    """Ranked candidates of one query, handed out a page at a time.
+
+    The query is scored once; every doc that passes min_similarity (at
+    most limit of the best) goes into a heap of (-score, row), which pops
+    in the same order as the engine's stable sort with ties broken by
+    row. Each page is then a few heap pops, and page n followed by page
+    n+1 equals search() with k = (n+1) * page_size.
+
+    Only stores scored by a single ScoringEngine (RecipeStore, plain
+    lists) support cursors, with or without filters; open() raises
+    TypeError for a SegmentedIndex or a sharded store. next_page() is
+    thread-safe, so one cursor may be shared between callers.
+    """
+
+    def __init__(self, columns, attribute, indices, scores, version=None):
+        self.columns = columns
+        self.attribute = attribute
+        self.version = version
+        self.returned = 0
+        self._lock = threading.RLock()
+        self._heap = list(zip((-np.asarray(scores, dtype=np.float64)).tolist(), np.asarray(indices).tolist()))
+        heapq.heapify(self._heap)
+
+    @classmethod
+    def open(cls, embedder, vector_store, query, min_similarity, limit=MAX_CANDIDATES, filters=None):
+        from search_function import query_embeddings
+
+        engine = get_engine(vector_store)
+        if not hasattr(engine, 'ranked_candidates'):
+            raise TypeError(f"{type(engine).__name__} does not support search cursors; "
+                            "use search() for segmented and sharded stores")
+        parsed_query = parse_query(query)
+        attribute, base_query, _ = parsed_query
+        query_embedding = query_embeddings(embedder, vector_store, [base_query])[0]
+        excluded = engine.filter_index.excluded(filters) if filters else None
+        indices, scores = engine.ranked_candidates(query_embedding, parsed_query, min_similarity, limit, excluded)
+        return cls(engine.columns, attribute, indices, scores, index_version(vector_store))
+
+    def __len__(self):
+        """Candidates not handed out yet"""
+        return len(self._heap)
+
+    @property
+    def exhausted(self):
+        return not self._heap
+
+    def next_page(self, page_size):
+        """Next page_size candidates projected onto the query's attribute.
+
+        Like search(), candidates without the attribute are dropped, so a
+        page may be shorter than page_size; an empty first page is NO_MATCH.
+        """
+        # 多个请求可能持有同一个令牌: 出堆和计数必须是原子的
+        with self._lock:
+            heap = self._heap
+            rows = [heapq.heappop(heap)[1] for _ in range(min(page_size, len(heap)))]
+            first = self.returned == 0
+            self.returned += len(rows)
+        if first:
+            return format_results(self.columns, rows, self.attribute)
+        # 之后的页没有结果时返回空列表, 不再重复 NO_MATCH
+        column = self.columns[self.attribute]
+        return [column[i] for i in rows if column[i] is not MISSING]
+
+
+# 续页令牌 -> SearchCursor; 过期的令牌随 LRU 淘汰
+cursor_cache = LRUCache(capacity=MAX_CURSORS)
+
+
+def search_page(embedder, vector_store, query=None, page_size=3, min_similarity=0.8, token=None, filters=None):
+    """One page of results and the token for the next page (None when there is none).
+
+    Pass query (and filters) for the first page and only token for the
+    following ones.
+    Raises KeyError for an unknown or expired token, and when the token's
+    vector_store has since been rebuilt or modified; TypeError for stores
+    without cursor support (see SearchCursor). Concurrent calls with the
+    same token get disjoint pages.
+    """
+    if token is None:
+        if query is None:
+            raise ValueError("either query or token is required")
+        cursor = SearchCursor.open(embedder, vector_store, query, min_similarity, filters=filters)
+        token = secrets.token_urlsafe(12)
+    else:
+        cursor = cursor_cache.get(token)
+        if cursor is None:
+            raise KeyError(f"unknown or expired cursor token {token!r}")
+        if cursor.version != index_version(vector_store):
+            cursor_cache.discard(token)
+            raise KeyError(f"cursor token {token!r} refers to an older index")
+    # 取页与登记/注销令牌在同一把锁内, 避免并发请求把已取完的游标放回缓存
+    with cursor._lock:
+        results = cursor.next_page(page_size)
+        if cursor.exhausted:
+            cursor_cache.discard(token)
+            return results, None
+        cursor_cache.put(token, cursor)
+    return results, token
+
+
+def search_iter(embedder, vector_store, query, page_size=3, min_similarity=0.8, limit=MAX_CANDIDATES, filters=None):
+    """Lazily yield pages of results for query; scoring happens once, before the first page"""
+    cursor = SearchCursor.open(embedder, vector_store, query, min_similarity, limit, filters)
+    results = cursor.next_page(page_size)
+    yield results
+    while not cursor.exhausted:
+        yield cursor.next_page(page_size)
+
+
+def benchmark(page_size=3, pages=5, min_similarity=0.3):
+    """Page latency of a cursor vs re-running search() with a growing k, checking identical pages"""
+    from caches import search_result_cache
+    from embedders import HashingEmbedder
+    from search_function import build_vector_store, get_recipe_data, search
+
+    embedder = HashingEmbedder()
+    store = build_vector_store(embedder, get_recipe_data())
+    suffixes = ['', ' ingredients', ' instructions', ' notes', ' serving size']
+    titles = list(store.columns['title'])
+    queries = [f"{title.lower()}{suffixes[i % len(suffixes)]}" for i, title in enumerate(titles)]
+
+    mismatches = 0
+    cursor_seconds = [0.0] * pages
+    rescore_seconds = [0.0] * pages
+    for query in queries:
+        start = time.perf_counter()
+        cursor = SearchCursor.open(embedder, store, query, min_similarity)
+        collected = []
+        for n in range(pages):
+            collected += cursor.next_page(page_size)
+            now = time.perf_counter()
+            cursor_seconds[n] += now - start
+            start = now
+        for n in range(pages):
+            search_result_cache.clear()
+            start = time.perf_counter()
+            expected = search(embedder, store, query, (n + 1) * page_size, min_similarity)
+            rescore_seconds[n] += time.perf_counter() - start
+        # 拼接后的页应与 k = pages * page_size 的 search() 结果一致
+        if [r for r in collected if r not in NO_MATCH] != [r for r in expected if r not in NO_MATCH]:
+            mismatches += 1
+    print(f"{len(queries)} queries over {len(store)} recipes, page size {page_size}")
+    print(f"{'page':>4} {'cursor us':>10} {'re-search us':>12}")
+    for n in range(pages):
+        print(f"{n + 1:>4} {1e6 * cursor_seconds[n] / len(queries):>10.1f} "
+              f"{1e6 * rescore_seconds[n] / len(queries):>12.1f}")
+    print(f"mismatches vs search(): {mismatches}")
+    return mismatches
+
+
+if __name__ == '__main__':
+    # 用法: python src/test/cursor.py [page_size]
+    sys.exit(1 if benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 3) else 0)
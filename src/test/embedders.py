@@ -0,0 +1,87 @@
+import sys
+import time
+import zlib
+from typing import Protocol, runtime_checkable
+
+import numpy as np
+
+
+@runtime_checkable
+class Embedder(Protocol):
+    """What the vector store, caches and search() need from an embedding model.
+
+    encode() takes a list of texts (or one text, returning a vector) and
+    returns a float32 matrix with one row per text. get_embedder() gives
+    SentenceTransformer objects ``name`` and ``dim``; embedding_dim() also
+    accepts one without them.
+    """
+
+    name: str
+    dim: int
+
+    def encode(self, texts, batch_size=32, **kwargs): ...
+
+
+def embedding_dim(embedder):
+    """Output dimension of an Embedder, or of a bare SentenceTransformer"""
+    if isinstance(embedder, Embedder):
+        return embedder.dim
+    return embedder.get_sentence_embedding_dimension()
+
+
+class HashingEmbedder:
+    """Deterministic offline embedder: signed feature hashing of character n-grams.
+
+    Needs no model weights or network and is fast enough to build and query
+    the index inside tests and benchmarks. Rows are L2-normalized like
+    all-MiniLM-L6-v2 outputs. Similar spellings get similar vectors, but
+    there is no semantics beyond shared substrings.
+    """
+
+    def __init__(self, dim=384, ngram_range=(3, 5)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+        self.name = f"hashing-char{ngram_range[0]}-{ngram_range[1]}-{dim}"
+
+    def _features(self, text):
+        text = f" {' '.join(text.lower().split())} "
+        lo, hi = self.ngram_range
+        # crc32 在不同进程间稳定 (内置 hash() 每个进程随机化)
+        return [zlib.crc32(text[i:i + n].encode('utf-8'))
+                for n in range(lo, hi + 1) for i in range(len(text) - n + 1)]
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, normalize_embeddings=False, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            hashes = np.array(self._features(text), dtype=np.uint32)
+            if len(hashes):
+                # 低位决定维度, 最高位决定符号, 减少冲突带来的偏差
+                signs = np.where(hashes >> 31, -1.0, 1.0)
+                out[row] = np.bincount(hashes % self.dim, weights=signs, minlength=self.dim)
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        out /= norms
+        return out[0] if single else out
+
+
+def benchmark(n_texts=2000, batch_size=32):
+    """Print texts/s of the hashing embedder on the recipe documents"""
+    import json
+
+    from recipe_store import document_text
+
+    with open("data/recipes.json", encoding="utf-8") as f:
+        texts = [document_text(recipe) for recipe in json.load(f)]
+    texts = (texts * (n_texts // len(texts) + 1))[:n_texts]
+    embedder = HashingEmbedder()
+    start = time.perf_counter()
+    embedder.encode(texts, batch_size=batch_size)
+    seconds = time.perf_counter() - start
+    print(f"{embedder.name}: {len(texts) / seconds:.0f} texts/s, dim {embedder.dim}")
+
+
+if __name__ == '__main__':
+    # 用法: python src/test/embedders.py [n_texts]
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
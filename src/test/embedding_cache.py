@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+import numpy as np
+
+from caches import model_name, model_revision, normalize_query
+from engine import normalize_rows
+
+# 放在 data/index 之外: save_index 会整体替换索引目录
+CACHE_PATH = "data/embeddings.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    model TEXT NOT NULL,
+    revision TEXT NOT NULL,
+    text_hash TEXT NOT NULL,
+    dim INTEGER NOT NULL,
+    vector BLOB NOT NULL,
+    PRIMARY KEY (model, revision, text_hash)
+) WITHOUT ROWID
+"""
+
+# sqlite 单条语句的参数个数有上限, 分批查询
+_BATCH = 500
+
+
+def text_hash(text):
+    """SHA-256 of the exact text passed to encode()"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """Persistent, content-addressed store of document embeddings.
+
+    Entries are keyed by (model name, model revision, SHA-256 of the text)
+    and hold the raw float32 output of ``encode(text)``, so rebuilding the
+    vector store after preprocess.py only encodes recipes whose text
+    changed. Stats count hits and misses for this process.
+    """
+
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get_many(self, model, revision, hashes):
+        """{text_hash: vector} for the hashes that are stored"""
+        found = {}
+        with self._lock:
+            for start in range(0, len(hashes), _BATCH):
+                chunk = hashes[start:start + _BATCH]
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND revision = ? "
+                    f"AND text_hash IN ({','.join('?' * len(chunk))})",
+                    [model, revision, *chunk],
+                )
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, model, revision, items):
+        """Store (text_hash, vector) pairs"""
+        rows = []
+        for key, vector in items:
+            vector = np.ascontiguousarray(vector, dtype=np.float32).ravel()
+            rows.append((model, revision, key, len(vector), vector.tobytes()))
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+    def encode(self, embedder, texts, model=None, **encode_kwargs):
+        """Raw embeddings of texts, encoding only the cache misses in one batch.
+
+        Entries are keyed by model (default: model_name(embedder), which
+        raises for an embedder without a stable name).
+        """
+        texts = list(texts)
+        model = model if model is not None else model_name(embedder)
+        revision = model_revision(embedder)
+        hashes = [text_hash(text) for text in texts]
+        found = self.get_many(model, revision, sorted(set(hashes)))
+        # 相同文本只编码一次
+        missing = {}
+        for key, text in zip(hashes, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        n_missing = sum(key not in found for key in hashes)
+        self.hits += len(texts) - n_missing
+        self.misses += n_missing
+        if missing:
+            encoded = embedder.encode(list(missing.values()), convert_to_numpy=True, **encode_kwargs)
+            fresh = dict(zip(missing, np.asarray(encoded, dtype=np.float32)))
+            self.put_many(model, revision, fresh.items())
+            found.update(fresh)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([found[key] for key in hashes])
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+            ).fetchone()
+            models = self._conn.execute(
+                "SELECT model, revision, COUNT(*) FROM embeddings GROUP BY model, revision ORDER BY model, revision"
+            ).fetchall()
+        return {
+            'path': self.path,
+            'entries': entries,
+            'vector_bytes': size,
+            'file_bytes': os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+            'models': [{'model': m, 'revision': r, 'entries': n} for m, r, n in models],
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def gc(self, live_texts, model=None):
+        """Delete entries whose text is not in live_texts (optionally only for one model).
+
+        Returns the number of deleted entries.
+        """
+        live = {text_hash(text) for text in live_texts}
+        with self._lock:
+            query = "SELECT model, revision, text_hash FROM embeddings"
+            params = ()
+            if model is not None:
+                query += " WHERE model = ?"
+                params = (model,)
+            orphans = [row for row in self._conn.execute(query, params) if row[2] not in live]
+            self._conn.executemany(
+                "DELETE FROM embeddings WHERE model = ? AND revision = ? AND text_hash = ?", orphans
+            )
+            self._conn.commit()
+            if orphans:
+                self._conn.execute("VACUUM")
+        return len(orphans)
+
+
+class CachedEmbedder:
+    """Embedder wrapper that serves encode() from an EmbeddingCache.
+
+    It keeps the wrapped model's name (or the configured model, e.g.
+    index_model_name()), so the title trie, the query cache and the
+    result cache treat it as the same model.
+    """
+
+    def __init__(self, embedder, cache, model=None):
+        self.embedder = embedder
+        self.cache = cache
+        self.name = model if model is not None else model_name(embedder)
+
+    def encode(self, sentences, convert_to_numpy=True, normalize_embeddings=False, **kwargs):
+        single = isinstance(sentences, str)
+        embeddings = self.cache.encode(self.embedder, [sentences] if single else sentences, self.name, **kwargs)
+        if normalize_embeddings and len(embeddings):
+            embeddings = normalize_rows(embeddings)
+        return embeddings[0] if single else embeddings
+
+    def __getattr__(self, name):
+        return getattr(self.embedder, name)
+
+
+def main(argv):
+    """python src/test/embedding_cache.py stats | gc [recipes.json]"""
+    from recipe_store import document_text
+
+    command = argv[0] if argv else 'stats'
+    with EmbeddingCache() as cache:
+        if command == 'stats':
+            print(json.dumps(cache.stats(), indent=2))
+        elif command == 'gc':
+            # 当前语料中仍会被编码的文本: 文档文本、标题和标题查询
+            with open(argv[1] if len(argv) > 1 else "data/recipes.json", encoding="utf-8") as f:
+                recipes = json.load(f)
+            live = [document_text(recipe) for recipe in recipes]
+            live += [recipe['title'] for recipe in recipes]
+            live += [normalize_query(recipe['title']) for recipe in recipes]
+            removed = cache.gc(live)
+            print(f"removed {removed} orphaned embeddings, {cache.stats()['entries']} left")
+        else:
+            print(main.__doc__)
+            return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
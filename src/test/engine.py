@@ -0,0 +1,599 @@
+import itertools
+from collections.abc import Sequence
+
+import numpy as np
+
+from ann import IVFIndex
+from bm25 import BM25Index
+from caches import LRUCache
+from filters import FilterIndex
+from projection import PROJECTIONS
+from prune import ProjectionBound
+from quantize import QUANTIZERS
+from title_index import TitleTokenIndex
+
+# 打分公式中的权重, 与 search() 原始实现保持一致
+TITLE_WEIGHT = 0.15
+DOC_WEIGHT = 0.85
+MATCH_BOOST = 0.2
+
+# 查询末尾可以带的属性后缀
+ATTRIBUTES = ['ingredients', 'instructions', 'notes', 'serving size']
+
+NO_MATCH = ['No matching documents!']
+
+# 上界计算的浮点余量, 保证剪枝不会误删
+BOUND_EPSILON = 1e-5
+
+# 与 BM25 融合的方式: None 表示只用原来的稠密分数
+FUSION_MODES = (None, 'weighted', 'rrf')
+
+# 过滤后剩余行不超过这个比例时, 只对剩余行做矩阵乘法
+SUBSET_FRACTION = 0.5
+
+
+def parse_query(query):
+    """Split a query into (attribute, base_query, query_tokens)"""
+    query_lower = query.lower()
+    attribute = None
+    base_query = query_lower
+
+    for attr in ATTRIBUTES:
+        if query_lower.endswith(' ' + attr):
+            attribute = attr.replace(' ', '_')  # 处理'serving size'的情况
+            base_query = query_lower[:-len(' ' + attr)].strip()
+            break
+
+    # 注意: 词元取自完整查询(包括属性后缀), 与原实现一致
+    query_tokens = [token for token in query_lower.strip().split() if token]
+    return attribute, base_query, query_tokens
+
+
+def normalize_rows(matrix):
+    """L2-normalize each row as float32, leaving all-zero rows untouched"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k_indices(scores, k, min_similarity):
+    """Indices of the k best scores >= min_similarity, best first.
+
+    Ties are broken by index so the order matches a stable descending
+    sort over the whole corpus.
+    """
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    candidates = np.flatnonzero(scores >= min_similarity)
+    if candidates.size > k:
+        cand_scores = scores[candidates]
+        part = np.argpartition(-cand_scores, k - 1)[:k]
+        kth = cand_scores[part].min()
+        # 保留与第 k 名同分的文档, 排序后再截断, 保证并列时顺序稳定
+        candidates = candidates[cand_scores >= kth]
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order][:k]
+
+
+class CombinedRows:
+    """Rows of TITLE_WEIGHT * title + DOC_WEIGHT * doc, computed only for the rows indexed.
+
+    The dense score is q · combined, so IVF and the quantizers work on
+    these rows; indexing in blocks avoids a full-size float32 temporary.
+    """
+
+    __slots__ = ('doc_matrix', 'title_matrix')
+
+    def __init__(self, doc_matrix, title_matrix):
+        self.doc_matrix = doc_matrix
+        self.title_matrix = title_matrix
+
+    @property
+    def shape(self):
+        return self.doc_matrix.shape
+
+    def __len__(self):
+        return len(self.doc_matrix)
+
+    def __getitem__(self, key):
+        return self.title_matrix[key] * TITLE_WEIGHT + self.doc_matrix[key] * DOC_WEIGHT
+
+
+# 结果列中表示"该食谱没有这个属性"的占位值
+MISSING = object()
+
+
+def full_text(metadata):
+    """Result string for a query without an attribute suffix"""
+    title = metadata['title']
+    ingredients = metadata.get('ingredients', '')
+    instructions = metadata.get('instructions', '')
+    return f"{title}\n{ingredients}\n{instructions}".strip()
+
+
+def result_columns(metadatas):
+    """Precomputed result values per attribute; key None holds the full text"""
+    columns = {None: [full_text(m) for m in metadatas]}
+    for attr in ATTRIBUTES:
+        key = attr.replace(' ', '_')
+        columns[key] = [m.get(key, MISSING) for m in metadatas]
+    return columns
+
+
+def format_results(columns, indices, attribute):
+    """Project the selected recipes onto the requested attribute"""
+    column = columns[attribute]
+    final_results = [column[i] for i in indices if column[i] is not MISSING]
+    return final_results or list(NO_MATCH)
+
+
+class ScoringEngine:
+    """Dense scoring over L2-normalized float32 doc and title matrices.
+
+    fusion selects how BM25 over the recipe fields is combined with the
+    dense score: 'weighted' adds fusion_weight * (bm25 / max bm25), 'rrf'
+    uses reciprocal-rank fusion with constant rrf_k. The candidates are
+    the dense hits (>= min_similarity) plus the fusion_candidates docs
+    with the best BM25 scores, so exact terms the dense model missed can
+    surface while a common term cannot pull most of the corpus into the
+    ranking and the exact re-score. 'weighted' applies
+    min_similarity to the fused score; RRF scores are not on the
+    similarity scale, so every candidate is ranked.
+
+    ann='ivf' replaces the exhaustive scan with an IVF candidate pool
+    (ann_probe nearest of ann_lists clusters of the combined title/doc
+    vectors, plus every title-boosted doc) that is then re-scored exactly.
+
+    quantize='int8' or 'pq' scores the pool on compressed codes first and
+    re-scores only the best `rerank` of them (plus boosted docs) against
+    the full-precision matrices, which may be memory-mapped so that only
+    the touched rows are paged in. quantizer= takes codes that were built
+    with the index (RecipeStore.quantizer()); otherwise they are built
+    from the matrices on the first query.
+
+    prune=True keeps exact results but skips dense scoring for documents
+    whose per-document upper bound (see prune.ProjectionBound, a rank
+    prune_dim projection) cannot reach min_similarity or, without fusion,
+    the k-th best score among the title-boosted docs and the k best
+    approximate scores, which are always scored exactly. The survivors
+    are scored in one batch, or by the full scan when more than
+    SUBSET_FRACTION of the corpus survives. pruning_stats counts the
+    skipped documents. When the embeddings' variance is spread over many
+    more than prune_dim directions the bounds prune almost nothing and
+    the bound pass is pure overhead on top of the full scan; `python
+    src/test/prune.py` reports pruned documents and latency against the
+    exhaustive scan.
+
+    reduce='pca' or 'random' projects the doc and title matrices to
+    reduce_dim dimensions (see projection.py) and projects every query
+    the same way before scoring; all other modes then run on the
+    reduced vectors. projection= instead takes an already fitted
+    projection for matrices that were reduced when the index was built
+    (RecipeStore.reduced()); only the queries are projected then.
+
+    search() and search_many() take optional structured filters (see
+    filters.filter_key); the filter mask is applied to the scores before
+    top-k selection, and exhaustive scoring of a selective filter only
+    multiplies the remaining rows. With ann or quantize, filtered-out rows
+    are kept out of the candidate pool before the IVF probe and re-rank
+    budget are spent.
+    """
+
+    def __init__(self, doc_matrix, title_matrix, metadatas,
+                 fusion=None, fusion_weight=0.3, rrf_k=60, fusion_candidates=100,
+                 ann=None, ann_lists=None, ann_probe=8,
+                 quantize=None, rerank=100, prune=False, prune_dim=64, reduce=None, reduce_dim=128,
+                 projection=None, quantizer=None, columns=None, normalized=False):
+        if fusion not in FUSION_MODES:
+            raise ValueError(f"unknown fusion mode: {fusion!r}")
+        # normalized=True: 调用方保证行已归一化, 直接使用而不复制
+        self.doc_matrix = doc_matrix if normalized else normalize_rows(doc_matrix)
+        self.title_matrix = title_matrix if normalized else normalize_rows(title_matrix)
+        if reduce not in (None, *PROJECTIONS):
+            raise ValueError(f"unknown reduce mode: {reduce!r}")
+        if reduce is not None and projection is not None:
+            raise ValueError("the index is already reduced; reduce cannot be applied again")
+        # projection 给定时矩阵在建库时已降维, 这里只投影查询
+        self.projection = projection
+        if reduce is not None and len(self.doc_matrix):
+            # 降维后重新归一化, 打分仍是余弦相似度
+            self.projection = PROJECTIONS[reduce](np.concatenate([self.doc_matrix, self.title_matrix]), reduce_dim)
+            self.doc_matrix = normalize_rows(self.projection.transform(self.doc_matrix))
+            self.title_matrix = normalize_rows(self.projection.transform(self.title_matrix))
+        self.metadatas = metadatas if isinstance(metadatas, Sequence) else list(metadatas)
+        self.columns = columns if columns is not None else result_columns(self.metadatas)
+        self.title_index = TitleTokenIndex(m['title'] for m in self.metadatas)
+        self.fusion = fusion
+        self.fusion_weight = fusion_weight
+        self.rrf_k = rrf_k
+        self.fusion_candidates = fusion_candidates
+        self._bm25 = None
+        self._filter_index = None
+        if ann not in (None, 'ivf'):
+            raise ValueError(f"unknown ann mode: {ann!r}")
+        self.ann = ann
+        self.ann_lists = ann_lists
+        self.ann_probe = ann_probe
+        self._ivf = None
+        if quantize not in (None, *QUANTIZERS):
+            raise ValueError(f"unknown quantize mode: {quantize!r}")
+        self.quantize = quantize
+        self.rerank = rerank
+        self._quantizer = quantizer
+        if prune and (ann or quantize):
+            raise ValueError("prune computes exact scores and cannot be combined with ann or quantize")
+        self.prune = prune
+        self.prune_dim = prune_dim
+        self._prune_bound = None
+        self.pruning_stats = {'queries': 0, 'scored': 0, 'pruned': 0}
+
+    @classmethod
+    def from_vector_store(cls, vector_store, **options):
+        docs = list(vector_store)
+        dim = docs[0]['embedding'].shape[-1] if docs else 0
+        doc_matrix = np.array([doc['embedding'] for doc in docs], dtype=np.float32).reshape(len(docs), dim)
+        title_matrix = np.array([doc['title_embedding'] for doc in docs], dtype=np.float32).reshape(len(docs), dim)
+        return cls(doc_matrix, title_matrix, [doc['metadata'] for doc in docs], **options)
+
+    @property
+    def bm25(self):
+        # 只有启用融合时才建 BM25 索引
+        if self._bm25 is None:
+            self._bm25 = BM25Index.from_recipes(self.metadatas)
+        return self._bm25
+
+    @property
+    def filter_index(self):
+        if self._filter_index is None:
+            self._filter_index = FilterIndex(self.metadatas)
+        return self._filter_index
+
+    @property
+    def ivf(self):
+        if self._ivf is None:
+            # 稠密分数 = q · (0.15 * title + 0.85 * doc), 对这个组合向量聚类
+            combined = self.title_matrix * TITLE_WEIGHT + self.doc_matrix * DOC_WEIGHT
+            self._ivf = IVFIndex(combined, n_lists=self.ann_lists, n_probe=self.ann_probe)
+        return self._ivf
+
+    @property
+    def quantizer(self):
+        if self._quantizer is None:
+            self._quantizer = QUANTIZERS[self.quantize](CombinedRows(self.doc_matrix, self.title_matrix))
+        return self._quantizer
+
+    @property
+    def prune_bound(self):
+        if self._prune_bound is None:
+            self._prune_bound = ProjectionBound(CombinedRows(self.doc_matrix, self.title_matrix), self.prune_dim)
+        return self._prune_bound
+
+    @property
+    def exhaustive(self):
+        return self.ann is None and self.quantize is None and not self.prune
+
+    def __len__(self):
+        return len(self.metadatas)
+
+    def add_boost(self, scores, query_tokens):
+        """Add 0.2 per query token found in a title, touching only matching docs"""
+        doc_ids, counts = self.title_index.match_counts(query_tokens)
+        scores[doc_ids] += counts * MATCH_BOOST
+        return scores
+
+    def prepare_queries(self, query_embeddings):
+        """Normalized query rows in the engine's (possibly reduced) space"""
+        q = normalize_rows(query_embeddings)
+        if self.projection is not None:
+            q = normalize_rows(self.projection.transform(q))
+        return q
+
+    def dense_scores_many(self, query_embeddings, ids=None):
+        """0.15 * title cosine + 0.85 * doc cosine, one row per query; only rows ids (-inf elsewhere) if given"""
+        q = self.prepare_queries(query_embeddings)
+        if ids is None:
+            title_similarity = (q @ self.title_matrix.T).astype(np.float64)
+            doc_similarity = (q @ self.doc_matrix.T).astype(np.float64)
+            return title_similarity * TITLE_WEIGHT + doc_similarity * DOC_WEIGHT
+        scores = np.full((len(q), len(self)), -np.inf)
+        title_similarity = (q @ self.title_matrix[ids].T).astype(np.float64)
+        doc_similarity = (q @ self.doc_matrix[ids].T).astype(np.float64)
+        scores[:, ids] = title_similarity * TITLE_WEIGHT + doc_similarity * DOC_WEIGHT
+        return scores
+
+    def exhaustive_scores_many(self, query_embeddings, excluded=None):
+        """dense_scores_many(), skipping the excluded rows when few rows remain"""
+        if excluded is not None:
+            ids = np.flatnonzero(~excluded)
+            if ids.size <= SUBSET_FRACTION * len(self):
+                return self.dense_scores_many(query_embeddings, ids)
+        return self.dense_scores_many(query_embeddings)
+
+    def candidate_pool(self, q, query_tokens, excluded=None, extra=None):
+        """Ids to score exactly: IVF lists and/or best quantized scores, plus boosted docs.
+
+        Excluded rows never enter the pool, so the IVF probe and the
+        quantized re-rank budget are spent on rows that can be returned.
+        """
+        allowed = None if excluded is None else ~excluded
+        ids = self.ivf.candidates(q, allowed=allowed) if self.ann else None
+        if ids is None and allowed is not None:
+            ids = np.flatnonzero(allowed)
+        if self.quantize:
+            approx = self.quantizer.scores(q, ids)
+            if len(approx) > self.rerank:
+                best = np.argpartition(-approx, self.rerank - 1)[:self.rerank]
+                ids = best if ids is None else ids[best]
+        if ids is None:
+            ids = np.arange(len(self), dtype=np.intp)
+        boosted, _ = self.title_index.match_counts(query_tokens)
+        if extra is not None:
+            # 融合模式下 BM25 命中的文档也要精确打分
+            boosted = np.union1d(boosted, extra)
+        if allowed is not None:
+            boosted = boosted[allowed[boosted]]
+        return np.union1d(ids, boosted)
+
+    def candidate_scores(self, query_embedding, query_tokens, excluded=None, extra=None):
+        """Exact dense scores on the candidate pool (plus extra ids), -inf everywhere else"""
+        q = self.prepare_queries(query_embedding)[0]
+        ids = self.candidate_pool(q, query_tokens, excluded, extra)
+        title_similarity = (self.title_matrix[ids] @ q).astype(np.float64)
+        doc_similarity = (self.doc_matrix[ids] @ q).astype(np.float64)
+        scores = np.full(len(self), -np.inf)
+        scores[ids] = title_similarity * TITLE_WEIGHT + doc_similarity * DOC_WEIGHT
+        return scores
+
+    def pruned_scores(self, query_embedding, query_tokens, k, min_similarity, excluded=None, extra=None):
+        """Exact dense scores for every doc that can still make the top k (and extra ids), -inf elsewhere"""
+        q = self.prepare_queries(query_embedding)[0]
+        n = len(self)
+        approx, bounds = self.prune_bound.scores(q)
+        bounds += BOUND_EPSILON
+        scores = np.full(n, -np.inf)
+        # 被排除的行视为已处理, 既不打分也不参与第 k 名的估计
+        scored = np.zeros(n, dtype=bool) if excluded is None else excluded.copy()
+        n_excluded = int(scored.sum())
+
+        def score_ids(ids):
+            title_similarity = (self.title_matrix[ids] @ q).astype(np.float64)
+            doc_similarity = (self.doc_matrix[ids] @ q).astype(np.float64)
+            scores[ids] = title_similarity * TITLE_WEIGHT + doc_similarity * DOC_WEIGHT
+            scored[ids] = True
+
+        # 有标题加分的文档和 BM25 命中 (可以低于 min_similarity 仍成为候选) 先全部精确打分
+        boosted, counts = self.title_index.match_counts(query_tokens)
+        must = boosted if extra is None else np.union1d(boosted, extra)
+        score_ids(must[~scored[must]])
+
+        threshold = min_similarity
+        # 融合模式会对所有过阈值的候选重新排序, 只能按 min_similarity 剪枝
+        if self.fusion is None and 0 < k < n - n_excluded:
+            # 近似分数最高的 k 个精确打分, 当前第 k 名的总分 (含标题加分) 是剪枝阈值
+            open_rows = np.where(scored, -np.inf, approx)
+            seeds = np.argpartition(-open_rows, k - 1)[:k]
+            score_ids(seeds[np.isfinite(open_rows[seeds])])
+            totals = scores.copy()
+            totals[boosted] += counts * MATCH_BOOST
+            done = np.flatnonzero(scored & np.isfinite(totals))
+            if done.size >= k:
+                threshold = max(threshold, np.partition(totals[done], done.size - k)[done.size - k])
+
+        # 上界达不到阈值的文档不可能进入结果; 其余一次性批量打分
+        survivors = np.flatnonzero((bounds >= threshold) & ~scored)
+        if survivors.size > SUBSET_FRACTION * n:
+            # 上界太松时直接全量扫描, 比按行挑选更快; 被排除的行由调用方置为 -inf
+            title_similarity = (self.title_matrix @ q).astype(np.float64)
+            doc_similarity = (self.doc_matrix @ q).astype(np.float64)
+            scores = title_similarity * TITLE_WEIGHT + doc_similarity * DOC_WEIGHT
+            scored[:] = True
+        else:
+            score_ids(survivors)
+
+        n_scored = int(scored.sum()) - n_excluded
+        self.pruning_stats['queries'] += 1
+        self.pruning_stats['scored'] += n_scored
+        self.pruning_stats['pruned'] += n - n_excluded - n_scored
+        return scores
+
+    def lexical_hits(self, base_query):
+        """(BM25 scores, sorted ids of the best fusion_candidates BM25 matches) for fusion modes.
+
+        (None, None) without fusion.
+        """
+        if self.fusion is None:
+            return None, None
+        lexical = self.bm25.scores(base_query)
+        hits = np.flatnonzero(lexical > 0)
+        n = self.fusion_candidates
+        if hits.size > n > 0:
+            # 常见词几乎命中整个语料, 只取 BM25 分数最高的 n 个, 候选集大小有上限
+            hits = np.sort(hits[np.argpartition(-lexical[hits], n - 1)[:n]])
+        elif hits.size > n:
+            hits = hits[:0]
+        return lexical, hits
+
+    def ranking(self, scores, base_query, min_similarity, lexical=None, hits=None):
+        """(indices, ranking scores) of every candidate (see the class docstring), in index order"""
+        if self.fusion is None:
+            candidates = np.flatnonzero(scores >= min_similarity)
+            return candidates, scores[candidates]
+        if lexical is None:
+            lexical, hits = self.lexical_hits(base_query)
+        # 稠密命中 + BM25 前 n 名; -inf 为未打分或被排除的行
+        hits = hits[np.isfinite(scores[hits])]
+        candidates = np.union1d(np.flatnonzero(scores >= min_similarity), hits)
+        if not candidates.size:
+            return candidates, scores[candidates]
+        dense = scores[candidates]
+        lexical = lexical[candidates]
+        if self.fusion == 'weighted':
+            top = lexical.max()
+            fused = dense + self.fusion_weight * (lexical / top if top > 0 else lexical)
+            keep = fused >= min_similarity
+            return candidates[keep], fused[keep]
+        fused = 1.0 / (self.rrf_k + _ranks(dense)) + 1.0 / (self.rrf_k + _ranks(lexical))
+        return candidates, fused
+
+    def rank(self, scores, base_query, k, min_similarity, lexical=None, hits=None):
+        """(indices, ranking scores) of the top k documents, fused with BM25 when enabled"""
+        if self.fusion is None:
+            indices = top_k_indices(scores, k, min_similarity)
+            return indices, scores[indices]
+        candidates, fused = self.ranking(scores, base_query, min_similarity, lexical, hits)
+        best = top_k_indices(fused, k, -np.inf)
+        return candidates[best], fused[best]
+
+    def ranked_candidates(self, query_embedding, parsed_query, min_similarity, limit=None, excluded=None):
+        """Unsorted (indices, ranking scores) of all docs passing min_similarity, or of the best limit.
+
+        Ranking scores are the ones rank() orders by, so sorting them by
+        (-score, index) reproduces search() for every k up to limit.
+        """
+        _, base_query, query_tokens = parsed_query
+        lexical, hits = self.lexical_hits(base_query)
+        if self.exhaustive:
+            dense = self.exhaustive_scores_many(query_embedding, excluded)[0]
+        elif self.prune:
+            depth = len(self) if limit is None else limit
+            dense = self.pruned_scores(query_embedding, query_tokens, depth, min_similarity, excluded, hits)
+        else:
+            dense = self.candidate_scores(query_embedding, query_tokens, excluded, hits)
+        scores = self.add_boost(dense, query_tokens)
+        if excluded is not None:
+            scores[excluded] = -np.inf
+        indices, values = self.ranking(scores, base_query, min_similarity, lexical, hits)
+        if limit is not None and len(indices) > limit:
+            best = top_k_indices(values, limit, -np.inf)
+            indices, values = indices[best], values[best]
+        return indices, values
+
+    def top_k_many(self, query_embeddings, parsed_queries, k, min_similarity, excluded=None):
+        """Per query (indices, ranking scores) of the top k docs.
+
+        excluded is an optional boolean mask of rows that must never be
+        returned (e.g. tombstoned rows of a segment or rows removed by a
+        filter).
+        """
+        lexical = [self.lexical_hits(base_query) for _, base_query, _ in parsed_queries]
+        if self.exhaustive:
+            dense = self.exhaustive_scores_many(query_embeddings, excluded)
+        elif self.prune:
+            # 逐行调用时由 prepare_queries() 归一化; 预先再归一化一次会改变末位, 影响并列顺序
+            query_embeddings = np.asarray(query_embeddings, dtype=np.float32).reshape(len(parsed_queries), -1)
+            dense = [self.pruned_scores(q, tokens, k, min_similarity, excluded, hits)
+                     for q, (_, _, tokens), (_, hits) in zip(query_embeddings, parsed_queries, lexical)]
+        else:
+            query_embeddings = np.asarray(query_embeddings, dtype=np.float32).reshape(len(parsed_queries), -1)
+            dense = [self.candidate_scores(q, tokens, excluded, hits)
+                     for q, (_, _, tokens), (_, hits) in zip(query_embeddings, parsed_queries, lexical)]
+        ranked = []
+        for row, (_, base_query, query_tokens), (bm25_scores, hits) in zip(dense, parsed_queries, lexical):
+            scores = self.add_boost(row, query_tokens)
+            if excluded is not None:
+                scores[excluded] = -np.inf
+            ranked.append(self.rank(scores, base_query, k, min_similarity, bm25_scores, hits))
+        return ranked
+
+    def search(self, query_embedding, parsed_query, k, min_similarity, filters=None):
+        return self.search_many(query_embedding, [parsed_query], k, min_similarity, filters)[0]
+
+    def search_many(self, query_embeddings, parsed_queries, k, min_similarity, filters=None):
+        """Score a batch of queries with one GEMM; parsed_queries come from parse_query()"""
+        excluded = self.filter_index.excluded(filters) if filters else None
+        ranked = self.top_k_many(query_embeddings, parsed_queries, k, min_similarity, excluded)
+        return [
+            format_results(self.columns, indices, attribute)
+            for (indices, _), (attribute, _, _) in zip(ranked, parsed_queries)
+        ]
+
+
+def _ranks(values):
+    """1-based descending ranks, ties broken by position"""
+    order = np.lexsort((np.arange(values.size), -values))
+    ranks = np.empty(values.size, dtype=np.float64)
+    ranks[order] = np.arange(1, values.size + 1)
+    return ranks
+
+
+_store_ids = itertools.count()
+
+
+class VersionedIndex:
+    """Mixin for stores that own a cached ScoringEngine and a version.
+
+    Subclasses call touch() on every mutation and implement build_engine().
+    """
+
+    def _init_versioning(self):
+        self.uid = next(_store_ids)
+        self.mutations = 0
+        self.engine_options = {}
+        self._engine = None
+        # 可选的 TitleTrie (自动补全和精确标题快速路径)
+        self.title_trie = None
+
+    @property
+    def version(self):
+        return (self.uid, self.mutations)
+
+    def touch(self):
+        self.mutations += 1
+        self._engine = None
+
+    def configure(self, **options):
+        """Set ScoringEngine options (e.g. fusion='rrf'); bumps the version"""
+        self.engine_options.update(options)
+        self.touch()
+
+    @property
+    def engine(self):
+        # 缓存的是 (版本, 引擎): 先记下版本再建引擎, 构建期间发生的 touch()
+        # 会让版本不一致, 旧引擎不会被当成新版本的引擎使用
+        version = self.version
+        cached = self._engine
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        engine = self.build_engine(**self.engine_options)
+        self._engine = (version, engine)
+        return engine
+
+    def build_engine(self, **options):
+        raise NotImplementedError
+
+
+# 普通 list 形式的 vector_store 按 id 缓存其打分引擎; 容量有限, 不会一直持有旧列表
+_engines = LRUCache(capacity=8)
+
+
+def _list_signature(vector_store):
+    # 每个条目的 id: 增删或替换条目都会改变; 原地修改条目字典检测不到
+    return tuple(map(id, vector_store))
+
+
+def index_version(vector_store):
+    """Hashable version of a vector_store; changes whenever it is rebuilt or mutated.
+
+    For a plain list only adding, removing or replacing entries is
+    visible, so search() does not cache results for plain lists.
+    """
+    if isinstance(vector_store, VersionedIndex):
+        return vector_store.version
+    return ('list', id(vector_store), hash(_list_signature(vector_store)))
+
+
+def get_engine(vector_store):
+    """Return the (cached) ScoringEngine for a vector_store"""
+    if isinstance(vector_store, VersionedIndex):
+        return vector_store.engine
+    key = id(vector_store)
+    signature = _list_signature(vector_store)
+    cached = _engines.get(key)
+    if cached is not None and cached[0] is vector_store and cached[1] == signature:
+        return cached[2]
+    engine = ScoringEngine.from_vector_store(vector_store)
+    _engines.put(key, (vector_store, signature, engine))
+    return engine
@@ -0,0 +1,206 @@
+import re
+import sys
+import time
+
+import numpy as np
+
+from caches import LRUCache
+
+# 可以要求"非空"的字段
+PRESENCE_FIELDS = ('notes', 'ingredients', 'instructions')
+
+# 标题分类: 标题中出现任一关键词即属于该类
+CATEGORIES = {
+    'breads': ('BREAD', 'BREADS', 'BISCUIT', 'BISCUITS', 'MUFFINS', 'WHUFFINS', 'ROLLS', 'BUNS', 'STICKS',
+               'TWISTS', 'CRESCENTS', 'PUPPIES', 'PINWHEELS', 'BOWKNOTS', 'RING'),
+    'breakfast': ('PANCAKES', 'WAFFLES', 'WAFFLE', 'GRIDDLECAKES', 'FLAPJACKS', 'DOUGHNUTS', 'BREAKFAST',
+                  'FRITTERS'),
+    'cakes': ('CAKE', 'SHORTCAKE', 'SHORTCAKES'),
+    'pies': ('PIE', 'PIES', 'COBBLER', 'CRISP', 'TURNOVERS'),
+    'desserts': ('PUDDING', 'COOKIES', 'BARS', 'SQUARES', 'DROPS', 'FUDGE', 'BROWNIE', 'COBBLER', 'CRISP',
+                 'GLACÉ'),
+    'main dishes': ('CHICKEN', 'MEAT', 'FISH', 'SHRIMP', 'SALMON', 'TUNA', 'SEA', 'PORK', 'BEEF', 'HAM',
+                    'HAMBURGER', 'SAUSAGE', 'FRANKS', 'BACON', 'CASSEROLE', 'STEW', 'PIZZA', 'DINNER',
+                    'SUPPER', 'LUNCH', 'SANDWICH', 'RABBIT', 'SOUFFLÉ', 'BARBECUE'),
+    'sauces': ('SAUCE', 'GLAZE'),
+}
+
+FILTER_KEYS = ('serving_size', 'has', 'category')
+
+
+def _as_tuple(value):
+    return (value,) if isinstance(value, str) else tuple(value)
+
+
+def _serving_bounds(value):
+    """(low, high) floats (or None) of a 'serving_size' filter; ValueError unless a 2-item sequence of numbers"""
+    if isinstance(value, (str, bytes)) or not hasattr(value, '__len__') or len(value) != 2:
+        raise ValueError(f"'serving_size' filter must be a (low, high) pair, got {value!r}")
+    try:
+        return tuple(None if bound is None else float(bound) for bound in value)
+    except (TypeError, ValueError):
+        raise ValueError(f"'serving_size' bounds must be numbers or None, got {value!r}") from None
+
+
+def filter_key(filters):
+    """Canonical hashable form of a filters dict (None for no filters); raises ValueError on bad filters.
+
+    filters may contain
+    - 'serving_size': (low, high), recipes whose serving range overlaps
+      [low, high]; either bound may be None. Recipes without a serving size
+      never match.
+    - 'has': a field name or list of them (see PRESENCE_FIELDS) that must
+      be non-empty.
+    - 'category': a title category or list of them (see CATEGORIES); any
+      one of them matches.
+    """
+    if not filters:
+        return None
+    unknown = set(filters) - set(FILTER_KEYS)
+    if unknown:
+        raise ValueError(f"unknown filters: {sorted(unknown)}")
+    serving = None
+    if filters.get('serving_size') is not None:
+        serving = _serving_bounds(filters['serving_size'])
+    has = tuple(sorted(set(_as_tuple(filters.get('has') or ()))))
+    for field in has:
+        if field not in PRESENCE_FIELDS:
+            raise ValueError(f"unknown field for 'has': {field!r}")
+    categories = tuple(sorted({name.lower() for name in _as_tuple(filters.get('category') or ())}))
+    for name in categories:
+        if name not in CATEGORIES:
+            raise ValueError(f"unknown category: {name!r}")
+    if serving is None and not has and not categories:
+        return None
+    return (serving, has, categories)
+
+
+def serving_range(metadata):
+    """(low, high) servings of a recipe, (0, 0) when unknown"""
+    value = metadata.get('serving_size')
+    try:
+        low, high = value
+        return float(low), float(high)
+    except (TypeError, ValueError):
+        return 0.0, 0.0
+
+
+def title_categories(title):
+    words = set(re.findall(r"[^\W\d_]+", title.upper()))
+    return [name for name, keywords in CATEGORIES.items() if words.intersection(keywords)]
+
+
+class FilterIndex:
+    """Precomputed row masks for structured filters over an engine's metadatas.
+
+    Presence and category filters are boolean bitmaps, one per field or
+    category. Serving-size ranges are answered from the known ranges
+    sorted by their low and by their high end: a range query is two
+    searchsorted() calls plus two scatters. The combined mask of each
+    distinct filter is cached, so repeated filters cost a dict lookup.
+    """
+
+    def __init__(self, metadatas, mask_cache_size=256):
+        n = len(metadatas)
+        self.n = n
+        servings = np.array([serving_range(m) for m in metadatas], dtype=np.float64).reshape(n, 2)
+        known = np.flatnonzero(servings[:, 1] > 0)
+        self._by_low = known[np.argsort(servings[known, 0], kind='stable')]
+        self._lows = servings[self._by_low, 0]
+        self._by_high = known[np.argsort(servings[known, 1], kind='stable')]
+        self._highs = servings[self._by_high, 1]
+        self.present = {
+            field: np.array([bool(str(m.get(field) or '').strip()) for m in metadatas], dtype=bool)
+            for field in PRESENCE_FIELDS
+        }
+        self.categories = {name: np.zeros(n, dtype=bool) for name in CATEGORIES}
+        for row, metadata in enumerate(metadatas):
+            for name in title_categories(metadata['title']):
+                self.categories[name][row] = True
+        self._masks = LRUCache(capacity=mask_cache_size)
+
+    def serving_mask(self, low, high):
+        """Rows whose serving range overlaps [low, high]"""
+        below = np.zeros(self.n, dtype=bool)
+        stop = len(self._lows) if high is None else np.searchsorted(self._lows, high, side='right')
+        below[self._by_low[:stop]] = True
+        above = np.zeros(self.n, dtype=bool)
+        start = 0 if low is None else np.searchsorted(self._highs, low, side='left')
+        above[self._by_high[start:]] = True
+        return below & above
+
+    def allowed(self, filters):
+        """Read-only mask of rows passing filters, or None when nothing is filtered"""
+        key = filter_key(filters)
+        if key is None:
+            return None
+        mask = self._masks.get(key)
+        if mask is None:
+            serving, has, categories = key
+            mask = np.ones(self.n, dtype=bool)
+            if serving is not None:
+                mask &= self.serving_mask(*serving)
+            for field in has:
+                mask &= self.present[field]
+            if categories:
+                mask &= np.logical_or.reduce([self.categories[name] for name in categories])
+            mask.setflags(write=False)
+            self._masks.put(key, mask)
+        return mask
+
+    def excluded(self, filters):
+        """Complement of allowed(): rows the engine must skip, or None"""
+        mask = self.allowed(filters)
+        return None if mask is None else ~mask
+
+
+def benchmark(n=200000, n_queries=256, batch=32, k=3, dim=384, seed=0):
+    """Queries/s with and without filters on a synthetic corpus, checking results against post-filtering"""
+    from ann import synthetic_vectors
+    from engine import ScoringEngine, parse_query
+
+    rng = np.random.default_rng(seed)
+    vectors = synthetic_vectors(2 * n + n_queries, dim=dim, seed=seed)
+    titles = [' '.join(rng.choice(['APPLE', 'CHICKEN', 'PIE', 'CAKE', 'PANCAKES', 'BISCUITS', 'SAUCE', 'NUT'], 2))
+              for _ in range(n)]
+    lows = rng.choice([0, 2, 4, 6, 8, 10, 12, 24], n)
+    metadatas = [{'title': title, 'serving_size': [int(low), int(low + rng.integers(0, 3) * 2 if low else 0)],
+                  'notes': 'note' if rng.random() < 0.2 else '', 'ingredients': '1 cup', 'instructions': 'Mix.'}
+                 for title, low in zip(titles, lows)]
+    engine = ScoringEngine(vectors[:n], vectors[n:2 * n], metadatas, normalized=True)
+    queries = vectors[2 * n:]
+    parsed = [parse_query(f"recipe {i}") for i in range(n_queries)]
+    cases = [
+        ('none', None),
+        ('serves 8-12', {'serving_size': (8, 12)}),
+        ('has notes', {'has': 'notes'}),
+        ('pies, serves 4+', {'category': 'pies', 'serving_size': (4, None)}),
+        ('cakes with notes', {'category': 'cakes', 'has': ['notes', 'ingredients']}),
+    ]
+    print(f"corpus {n} x {dim}, {n_queries} queries in batches of {batch}")
+    print(f"{'filter':>18} {'rows':>7} {'queries/s':>10} {'identical':>9}")
+    mismatches = 0
+    for label, filters in cases:
+        excluded = engine.filter_index.excluded(filters)
+        start = time.perf_counter()
+        ranked = []
+        for i in range(0, n_queries, batch):
+            ranked += engine.top_k_many(queries[i:i + batch], parsed[i:i + batch], k, 0.0, excluded)
+        rate = n_queries / (time.perf_counter() - start)
+        # 对照: 全量打分后把被过滤的行置为 -inf
+        dense = engine.dense_scores_many(queries)
+        if excluded is not None:
+            dense[:, excluded] = -np.inf
+        same = all(
+            np.array_equal(indices, engine.rank(engine.add_boost(row, tokens), base, k, 0.0)[0])
+            for (indices, _), row, (_, base, tokens) in zip(ranked, dense, parsed)
+        )
+        mismatches += not same
+        rows = n if excluded is None else n - int(excluded.sum())
+        print(f"{label:>18} {rows:>7} {rate:>10.1f} {str(same):>9}")
+    return mismatches
+
+
+if __name__ == '__main__':
+    # 用法: python src/test/filters.py [n]
+    sys.exit(1 if benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 200000) else 0)
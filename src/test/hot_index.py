@@ -0,0 +1,218 @@
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from embedders import embedding_dim
+from engine import NO_MATCH
+from search_function import (EMBEDDING_CACHE, INDEX_DIR, RECIPES_PATH, index_quantize, index_reduce,
+                             open_vector_store, search)
+
+
+class ReloadError(RuntimeError):
+    """A rebuilt index failed validation and was not swapped in"""
+
+
+def validate_store(store, embedder, recipe_data):
+    """Raise ReloadError unless store looks like a usable index of recipe_data"""
+    if len(store) == 0 or len(store) != len(recipe_data):
+        raise ReloadError(f"index has {len(store)} rows for {len(recipe_data)} recipes")
+    dim = embedding_dim(embedder)
+    if dim != store.query_dim:
+        raise ReloadError(f"index dimension {store.query_dim} does not match the embedder ({dim})")
+    for name in ('doc_matrix', 'title_matrix'):
+        if not np.isfinite(getattr(store, name)).all():
+            raise ReloadError(f"{name} contains NaN or inf")
+    # 新索引先完整跑一次查询 (同时建好打分引擎), 再对外可见
+    if search(embedder, store, recipe_data[0]['title'], k=1, min_similarity=-np.inf) == NO_MATCH:
+        raise ReloadError("probe query returned no results")
+
+
+class IndexHolder:
+    """Serves searches from an index snapshot that can be replaced while serving.
+
+    reload() reads recipes_path, opens or rebuilds the index in the calling
+    thread (reload_in_background() uses a daemon thread), validates it and
+    publishes it with a single reference assignment. search() reads
+    ``snapshot`` once and never takes a lock, so in-flight queries finish
+    on the index they started with. watch() polls recipes_path and reloads
+    when its mtime or size changes.
+    """
+
+    def __init__(self, embedder, model, recipes_path=RECIPES_PATH, index_dir=INDEX_DIR,
+                 cache_path=EMBEDDING_CACHE):
+        self.embedder = embedder
+        self.model = model
+        self.recipes_path = recipes_path
+        self.index_dir = index_dir
+        self.cache_path = cache_path
+        self.snapshot = None
+        self._reload_lock = threading.Lock()
+        self._reload_thread = None
+        self._watcher = None
+        self._stop = threading.Event()
+        self._file_state = None
+        # 查询计数会被多个线程同时更新, += 不是原子操作
+        self._metrics_lock = threading.Lock()
+        self.metrics = {
+            'queries': 0,
+            'dropped_queries': 0,
+            'reloads': 0,
+            'failed_reloads': 0,
+            'last_reload_seconds': 0.0,
+            'max_reload_seconds': 0.0,
+            'last_error': None,
+        }
+
+    def _stat(self):
+        info = os.stat(self.recipes_path)
+        return (info.st_mtime_ns, info.st_size)
+
+    def reload(self):
+        """Build, validate and swap in a new snapshot; returns it (raises ReloadError on failure)"""
+        with self._reload_lock:
+            start = time.perf_counter()
+            try:
+                file_state = self._stat()
+                with open(self.recipes_path, encoding="utf-8") as f:
+                    recipe_data = json.load(f)
+                store = open_vector_store(self.embedder, recipe_data, self.model, self.index_dir, self.cache_path,
+                                          reduce=index_reduce(), quantize=index_quantize())
+                validate_store(store, self.embedder, recipe_data)
+            except Exception as exc:
+                self.metrics['failed_reloads'] += 1
+                self.metrics['last_error'] = repr(exc)
+                if isinstance(exc, ReloadError):
+                    raise
+                raise ReloadError(f"reload failed: {exc!r}") from exc
+            # 一次引用赋值即完成切换; 旧快照由仍在使用它的查询持有直到结束
+            self.snapshot = store
+            self._file_state = file_state
+            seconds = time.perf_counter() - start
+            self.metrics['reloads'] += 1
+            self.metrics['last_reload_seconds'] = seconds
+            self.metrics['max_reload_seconds'] = max(self.metrics['max_reload_seconds'], seconds)
+            self.metrics['last_error'] = None
+            return store
+
+    def reload_in_background(self):
+        """Start reload() in a daemon thread unless one is already running"""
+        if self._reload_thread is not None and self._reload_thread.is_alive():
+            return self._reload_thread
+
+        def run():
+            try:
+                self.reload()
+            except ReloadError as exc:
+                print(f"index reload failed, still serving the old snapshot: {exc}")
+
+        self._reload_thread = threading.Thread(target=run, name='index-reload', daemon=True)
+        self._reload_thread.start()
+        return self._reload_thread
+
+    def watch(self, interval=1.0):
+        """Poll recipes_path every interval seconds and reload in the background on change"""
+        def poll():
+            while not self._stop.wait(interval):
+                try:
+                    changed = self._stat() != self._file_state
+                except OSError:
+                    # 文件正在被替换时可能暂时不存在
+                    continue
+                if changed:
+                    self.reload_in_background().join()
+
+        self._stop.clear()
+        self._watcher = threading.Thread(target=poll, name='index-watch', daemon=True)
+        self._watcher.start()
+        return self._watcher
+
+    def stop(self):
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+
+    def record_queries(self, n, dropped=0):
+        """Count n queries, dropped of which failed; safe to call from any thread"""
+        with self._metrics_lock:
+            self.metrics['queries'] += n
+            self.metrics['dropped_queries'] += dropped
+
+    def search(self, query, k, min_similarity, filters=None):
+        store = self.snapshot
+        if store is None:
+            self.record_queries(1, dropped=1)
+            raise RuntimeError("no index loaded yet")
+        try:
+            results = search(self.embedder, store, query, k, min_similarity, filters)
+        except Exception:
+            self.record_queries(1, dropped=1)
+            raise
+        self.record_queries(1)
+        return results
+
+
+def demo(n_reloads=5, seconds_between=0.3):
+    """Reload repeatedly while a thread keeps searching; prints reload metrics"""
+    import shutil
+    import tempfile
+
+    from embedders import HashingEmbedder
+
+    embedder = HashingEmbedder()
+    workdir = tempfile.mkdtemp(prefix='hot-index-')
+    try:
+        recipes_path = os.path.join(workdir, 'recipes.json')
+        shutil.copy(RECIPES_PATH, recipes_path)
+        with open(recipes_path, encoding="utf-8") as f:
+            recipes = json.load(f)
+        holder = IndexHolder(embedder, embedder.name, recipes_path,
+                             os.path.join(workdir, 'index'), os.path.join(workdir, 'embeddings.sqlite'))
+        holder.reload()
+        holder.watch(interval=0.05)
+
+        stop = threading.Event()
+        errors = []
+
+        def client():
+            queries = [recipe['title'].lower() + ' ingredients' for recipe in recipes]
+            i = 0
+            while not stop.is_set():
+                try:
+                    holder.search(queries[i % len(queries)] + f" {i}", k=3, min_similarity=0.5)
+                except Exception as exc:
+                    errors.append(exc)
+                i += 1
+
+        threads = [threading.Thread(target=client) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for n in range(n_reloads):
+            time.sleep(seconds_between)
+            # 模拟 preprocess.py 重新生成文件: 写临时文件再原子替换
+            recipes[n % len(recipes)]['notes'] += ' (updated)'
+            tmp = recipes_path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(recipes, f)
+            os.replace(tmp, recipes_path)
+        time.sleep(seconds_between)
+        holder.stop()
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        updated = holder.snapshot.metadata(0)['notes'].endswith('(updated)')
+        print(json.dumps(holder.metrics, indent=2))
+        print(f"client errors: {len(errors)}, latest edit visible: {updated}")
+        return holder.metrics['dropped_queries'] + len(errors)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    # 用法: python src/test/hot_index.py [n_reloads]
+    sys.exit(1 if demo(int(sys.argv[1]) if len(sys.argv) > 1 else 5) else 0)
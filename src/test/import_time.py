@@ -0,0 +1,38 @@
+import os
+import subprocess
+import sys
+
+# search_function 的导入预算: 模型、语料和索引都在第一次使用时才加载
+BUDGET_MS = 50.0
+
+
+def import_timings(module):
+    """[(self + children microseconds, name)] from python -X importtime for importing module"""
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr}")
+    timings = []
+    for line in proc.stderr.splitlines():
+        # 格式: "import time: self [us] | cumulative | imported package"
+        parts = line.split('|')
+        if len(parts) == 3 and parts[0].startswith('import time:') and parts[1].strip().isdigit():
+            timings.append((int(parts[1]), parts[2].strip()))
+    return timings
+
+
+def check_import_time(module='search_function', budget_ms=BUDGET_MS):
+    """Print the cumulative import time of module and its slowest imports; False if over budget"""
+    timings = import_timings(module)
+    total_ms = next((us for us, name in timings if name == module), 0) / 1000
+    print(f'import {module}: {total_ms:.1f} ms (budget {budget_ms:.1f} ms)')
+    for us, name in sorted(timings, reverse=True)[:5]:
+        print(f'  {us / 1000:8.1f} ms  {name}')
+    return total_ms <= budget_ms
+
+
+if __name__ == '__main__':
+    # 用法: python src/test/import_time.py [module] [budget_ms]
+    sys.exit(0 if check_import_time(*sys.argv[1:2], *map(float, sys.argv[2:3])) else 1)
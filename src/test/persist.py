@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from projection import LinearProjection
+from quantize import QUANTIZERS
+from recipe_store import RecipeStore
+from title_trie import TitleTrie
+
+# 索引目录格式版本, 不兼容的改动需要加一
+FORMAT_VERSION = 2
+
+MANIFEST = 'manifest.json'
+DOC_MATRIX = 'doc_embeddings.npy'
+TITLE_MATRIX = 'title_embeddings.npy'
+METADATA = 'recipes.json'
+TITLE_QUERIES = 'title_queries.npy'
+PROJECTION = 'projection.npy'
+
+
+class IndexMismatchError(ValueError):
+    """The on-disk index does not match the requested model or corpus"""
+
+
+def corpus_checksum(recipes):
+    """SHA-256 of the recipes in a canonical JSON form"""
+    blob = json.dumps(list(recipes), sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+def quantizer_file(mode, name):
+    return f"quantized_{mode}_{name}.npy"
+
+
+def save_index(store, path, model, quantize=()):
+    """Write store to the directory path (replacing it atomically).
+
+    For a reduced store (RecipeStore.reduced()) the projected matrices are
+    saved together with the projection components. The quantized codes
+    of every mode in quantize, and of any the store has already built,
+    are saved too (see RecipeStore.quantizer()).
+    """
+    if not isinstance(store, RecipeStore):
+        store = RecipeStore.from_vector_store(store)
+    # 量化码本在建库时构建一次, 与矩阵一起保存
+    quantizers = {mode: store.quantizer(mode) for mode in quantize}
+    quantizers.update(store.quantizers)
+    recipes = [store.metadata(i) for i in range(len(store))]
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'model': model,
+        'dim': store.dim,
+        'count': len(store),
+        'corpus_checksum': corpus_checksum(recipes),
+        'files': {'doc': DOC_MATRIX, 'title': TITLE_MATRIX, 'metadata': METADATA},
+    }
+
+    path = os.path.abspath(path)
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix='.index-', dir=parent)
+    try:
+        os.chmod(tmp, 0o755)
+        np.save(os.path.join(tmp, DOC_MATRIX), np.ascontiguousarray(store.doc_matrix, dtype=np.float32))
+        np.save(os.path.join(tmp, TITLE_MATRIX), np.ascontiguousarray(store.title_matrix, dtype=np.float32))
+        with open(os.path.join(tmp, METADATA), 'w', encoding='utf-8') as f:
+            json.dump(recipes, f, ensure_ascii=False, separators=(',', ':'))
+        trie = store.title_trie
+        if trie is not None and trie.model is not None:
+            # 按行顺序保存, 键由标题推出, 清单大小与语料无关
+            np.save(os.path.join(tmp, TITLE_QUERIES), trie.row_embeddings(store.columns['title']))
+            manifest['title_queries'] = {'file': TITLE_QUERIES, 'model': trie.model}
+        projection = getattr(store, 'projection', None)
+        if projection is not None:
+            np.save(os.path.join(tmp, PROJECTION), projection.components)
+            manifest['projection'] = {'file': PROJECTION, 'mode': projection.mode, 'dim': projection.dim}
+        if quantizers:
+            manifest['quantizers'] = {}
+        for mode, quantizer in quantizers.items():
+            files = manifest['quantizers'][mode] = {}
+            for name, array in quantizer.arrays().items():
+                files[name] = quantizer_file(mode, name)
+                np.save(os.path.join(tmp, files[name]), array)
+        with open(os.path.join(tmp, MANIFEST), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+        # 先挪走旧目录再换上新目录, 读者不会看到写了一半的索引
+        old = None
+        if os.path.exists(path):
+            old = tempfile.mkdtemp(prefix='.index-old-', dir=parent)
+            os.replace(path, os.path.join(old, 'index'))
+        os.replace(tmp, path)
+        if old is not None:
+            shutil.rmtree(old, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return manifest
+
+
+def read_manifest(path):
+    with open(os.path.join(path, MANIFEST), encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('format_version') != FORMAT_VERSION:
+        raise IndexMismatchError(f"unsupported index format {manifest.get('format_version')!r}")
+    return manifest
+
+
+def load_index(path, model=None, checksum=None, reduce=None, quantize=()):
+    """Open an index saved by save_index; embedding matrices and quantized codes are memory-mapped read-only.
+
+    Raises IndexMismatchError if model or checksum are given and differ
+    from the manifest, if the saved reduction is not reduce (a
+    (mode, dim) pair, None for full-dimension vectors), or if the codes of
+    a quantize mode were not saved.
+    """
+    manifest = read_manifest(path)
+    saved = manifest.get('projection')
+    saved_reduce = (saved['mode'], saved['dim']) if saved else None
+    if saved_reduce != (tuple(reduce) if reduce else None):
+        raise IndexMismatchError(f"index reduction is {saved_reduce!r}, not {reduce!r}")
+    if model is not None and manifest['model'] != model:
+        raise IndexMismatchError(f"index was built with {manifest['model']!r}, not {model!r}")
+    if checksum is not None and manifest['corpus_checksum'] != checksum:
+        raise IndexMismatchError("index corpus checksum does not match")
+    saved_quantizers = manifest.get('quantizers', {})
+    missing = [mode for mode in quantize if mode not in saved_quantizers]
+    if missing:
+        raise IndexMismatchError(f"index has no quantized codes for {missing!r}")
+
+    with open(os.path.join(path, METADATA), encoding='utf-8') as f:
+        recipes = json.load(f)
+    # mmap 打开: 页面按需载入, 多个进程共享同一份页缓存
+    doc_matrix = np.load(os.path.join(path, DOC_MATRIX), mmap_mode='r')
+    title_matrix = np.load(os.path.join(path, TITLE_MATRIX), mmap_mode='r')
+    if doc_matrix.shape != (manifest['count'], manifest['dim']) or title_matrix.shape != doc_matrix.shape:
+        raise IndexMismatchError("embedding matrix shape does not match the manifest")
+    store = RecipeStore.from_matrices(recipes, doc_matrix, title_matrix)
+    if saved:
+        store.projection = LinearProjection(np.load(os.path.join(path, saved['file'])), saved['mode'])
+    for mode, files in saved_quantizers.items():
+        arrays = {name: np.load(os.path.join(path, file), mmap_mode='r') for name, file in files.items()}
+        if len(arrays['codes']) != manifest['count']:
+            raise IndexMismatchError(f"{mode} codes do not match the manifest")
+        store.quantizers[mode] = QUANTIZERS[mode].from_arrays(**arrays)
+
+    title_queries = manifest.get('title_queries')
+    if title_queries:
+        embeddings = np.load(os.path.join(path, title_queries['file']), mmap_mode='r')
+        if embeddings.shape[0] != manifest['count']:
+            raise IndexMismatchError("title query matrix does not match the manifest")
+        store.title_trie = TitleTrie.from_embeddings(
+            (recipe['title'] for recipe in recipes), embeddings, title_queries['model']
+        )
+    return store
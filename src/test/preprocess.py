@@ -487,65 +487,75 @@ def parse_recipe(text):
         "instructions": instructions
     }
 
-# Read file
-with open('data/recipes.txt', 'r', encoding='utf-8') as f:
-    text = f.read()
-
-# Split text by line
-lines = text.split('\n')
-# Extract text from line 46 to line 1826
-text = '\n'.join(lines[46:1826])
-
-# Use regular expression to find all matches
-recipe_pattern = re.compile(r'(?:(?:\[Illustration:\s*)?|["“”‘’])?([A-ZÉÈÊËÀÂÄÇÎÏÔÖÙÛÜŸÆŒ][A-ZÉÈÊËÀÂÄÇÎÏÔÖÙÛÜŸÆŒ\s\-,"“”‘’]+)(?:\]|["“”‘’])?(?:\s*\n|\s*$)')
-matches = []
-pos = 0
-
-while True:
-    match = recipe_pattern.search(text, pos)
-    if not match:
-        break
-    # Verify this is actually a recipe title by checking surrounding context
-    title = match.group(1).strip().strip('"').strip('”').strip('“')
-    if not any(title.startswith(skip) for skip in ['Step ', 'INDEX']):
-        matches.append(match)
-    pos = match.end()
+# 正文中需要解析的行范围 (跳过前言和索引)
+BODY_LINES = slice(46, 1826)
+
+RECIPE_PATTERN = re.compile(r'(?:(?:\[Illustration:\s*)?|["“”‘’])?([A-ZÉÈÊËÀÂÄÇÎÏÔÖÙÛÜŸÆŒ][A-ZÉÈÊËÀÂÄÇÎÏÔÖÙÛÜŸÆŒ\s\-,"“”‘’]+)(?:\]|["“”‘’])?(?:\s*\n|\s*$)')
 
 # Define titles to skip
-skip_titles = {
+SKIP_TITLES = {
     'BREADS', 'CAKES', 'COOKIES', 'DESSERTS', 'MAIN DISHES',
     'SAUCES AND GRAVIES', 'MENUS', 'INDEX', 'Betty Crocker',
     'Step 1', 'Step 2', 'Step 3', 'Step 4', 'HOW TO MAKE GOOD BISCUITS','SUNDAY BRUNCH'
 }
 
-# Parse all recipes
-all_recipes = []
-recipe_dict = {}  # For quick lookup of recipes
+def parse_recipes(text):
+    """Parse every recipe in the raw cookbook text"""
+    # Split text by line
+    lines = text.split('\n')
+    # Extract text from line 46 to line 1826
+    text = '\n'.join(lines[BODY_LINES])
 
-for i, match in enumerate(matches):
-    title = match.group(1).strip().strip('"').strip('”').strip('“')  # Remove all types of quotes
-    
-    # Skip non-recipe titles
-    if title in skip_titles:
-        continue
-    
-    # Get text between current recipe and next recipe
-    start = match.end()
-    end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
-    recipe_text = match.group(0) + text[start:end]
-    
-    # Parse recipe
-    recipe = parse_recipe(recipe_text)
-    if recipe:
-        all_recipes.append(recipe)
-        recipe_dict[recipe['title']] = recipe
+    # Use regular expression to find all matches
+    matches = []
+    pos = 0
+
+    while True:
+        match = RECIPE_PATTERN.search(text, pos)
+        if not match:
+            break
+        # Verify this is actually a recipe title by checking surrounding context
+        title = match.group(1).strip().strip('"').strip('”').strip('“')
+        if not any(title.startswith(skip) for skip in ['Step ', 'INDEX']):
+            matches.append(match)
+        pos = match.end()
 
-print(f"Successfully parsed {len(all_recipes)} recipes")
+    # Parse all recipes
+    all_recipes = []
 
-# Save results to JSON file
-with open('data/recipes.json', 'w', encoding='utf-8') as f:
-    json.dump(all_recipes, f, indent=2)
-print("Results saved to recipes.json")
+    for i, match in enumerate(matches):
+        title = match.group(1).strip().strip('"').strip('”').strip('“')  # Remove all types of quotes
+
+        # Skip non-recipe titles
+        if title in SKIP_TITLES:
+            continue
+
+        # Get text between current recipe and next recipe
+        start = match.end()
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        recipe_text = match.group(0) + text[start:end]
+
+        # Parse recipe
+        recipe = parse_recipe(recipe_text)
+        if recipe:
+            all_recipes.append(recipe)
+
+    return all_recipes
+
+def preprocess(source='data/recipes.txt', target='data/recipes.json'):
+    """Parse source and write the recipes to target as JSON"""
+    # Read file
+    with open(source, 'r', encoding='utf-8') as f:
+        text = f.read()
+
+    all_recipes = parse_recipes(text)
+    print(f"Successfully parsed {len(all_recipes)} recipes")
+
+    # Save results to JSON file
+    with open(target, 'w', encoding='utf-8') as f:
+        json.dump(all_recipes, f, indent=2)
+    print("Results saved to recipes.json")
+    return all_recipes
 
 # Test case
 class Cookbook:
@@ -570,7 +580,6 @@ class Cookbook:
             return self.recipes[unquoted_name]
         raise KeyError(name)
 
-book = Cookbook(all_recipes)
 test_cases = [
     ('CHEESE SAUCE', 'instructions', 'Stir in 2 cups grated sharp cheese.'),
     ('HUSH PUPPIES', 'ingredients', '1 cup corn meal\n1 cup Bisquick\n1 tsp. salt\n1 egg\n1 cup milk'),
@@ -589,14 +598,21 @@ test_cases = [
     ('JAM TWISTS', 'ingredients', '1 egg\n½ cup cream or ⅓ cup milk\n2 cups Bisquick\n2 tbsp. sugar\n⅓ cup thick jam or preserves'),
     ('SALMON, TUNA, OR CHICKEN SOUFFLÉ', 'instructions', 'Try 1 cup salmon or tuna, or 1½ cups cut-up cooked chicken, in place of cheese. Add 1 tbsp. lemon juice, 1 tsp. grated onion.')]
 
-score = 0
-for name, attribute, value in test_cases:
-    if book[name][attribute] == value:
-        score += 1
-    else:
-        print(f'{name} test case failed! {attribute} incorrect')
-        print('Reference: ', value)
-        print('Hypothesis: ', book[name][attribute])
-        print('---')
-
-print(f'Score: {score}/{len(test_cases)}')
\ No newline at end of file
+def run_tests(all_recipes):
+    book = Cookbook(all_recipes)
+    score = 0
+    for name, attribute, value in test_cases:
+        if book[name][attribute] == value:
+            score += 1
+        else:
+            print(f'{name} test case failed! {attribute} incorrect')
+            print('Reference: ', value)
+            print('Hypothesis: ', book[name][attribute])
+            print('---')
+
+    print(f'Score: {score}/{len(test_cases)}')
+    return score
+
+if __name__ == '__main__':
+    # python src/test/preprocess.py: 重新生成 data/recipes.json 并运行测试
+    run_tests(preprocess())
@@ -0,0 +1,113 @@
+import sys
+
+import numpy as np
+
+# 可选的降维维度
+REDUCED_DIMS = (64, 128, 192)
+
+
+class LinearProjection:
+    """x @ components; a saved projection is restored as this class"""
+
+    mode = None
+
+    def __init__(self, components, mode=None):
+        self.components = np.ascontiguousarray(components, dtype=np.float32)
+        if mode is not None:
+            self.mode = mode
+
+    @property
+    def dim(self):
+        return self.components.shape[1]
+
+    @property
+    def input_dim(self):
+        return self.components.shape[0]
+
+    def transform(self, vectors):
+        return np.asarray(vectors, dtype=np.float32) @ self.components
+
+
+class PCAProjection(LinearProjection):
+    """Project onto the top principal directions of the (uncentered) rows.
+
+    The directions are the leading right singular vectors of the stacked
+    doc and title matrices, which preserve their dot products best in the
+    least-squares sense. Rows are not centered, since scores are cosines
+    against the raw vectors.
+    """
+
+    mode = 'pca'
+
+    def __init__(self, vectors, dim):
+        vectors = np.asarray(vectors, dtype=np.float64)
+        if not 0 < dim <= vectors.shape[1]:
+            raise ValueError(f"cannot reduce {vectors.shape[1]} dims to {dim}")
+        # 对 d x d 的二阶矩矩阵做特征分解, 比对整个矩阵做 SVD 便宜
+        eigenvalues, eigenvectors = np.linalg.eigh(vectors.T @ vectors)
+        order = np.argsort(eigenvalues)[::-1][:dim]
+        super().__init__(eigenvectors[:, order])
+        total = eigenvalues.sum()
+        self.explained = float(eigenvalues[order].sum() / total) if total > 0 else 1.0
+
+
+class RandomProjection(LinearProjection):
+    """Seeded Gaussian random projection (Johnson-Lindenstrauss); needs no fitting"""
+
+    mode = 'random'
+
+    def __init__(self, vectors, dim, seed=0):
+        in_dim = np.asarray(vectors).shape[1]
+        if not 0 < dim <= in_dim:
+            raise ValueError(f"cannot reduce {in_dim} dims to {dim}")
+        rng = np.random.default_rng(seed)
+        super().__init__(rng.standard_normal((in_dim, dim)) / np.sqrt(dim))
+
+
+PROJECTIONS = {'pca': PCAProjection, 'random': RandomProjection}
+
+
+def _agreement(full, reduced, k):
+    return np.mean([len(set(a[:k]) & set(b[:k])) / max(1, min(k, len(a))) for a, b in zip(full, reduced)])
+
+
+def report(ks=(3, 10), dims=REDUCED_DIMS):
+    """Top-k agreement with the full-dimension ranking and reference test score per mode"""
+    from engine import parse_query
+    from search_function import get_embedder, get_vector_store, query_embeddings, run_tests, test_cases
+
+    embedder, store = get_embedder(), get_vector_store()
+    options = dict(store.engine_options)
+    # 评估查询: 参考测试的查询, 以及每个标题去掉第一个词后的部分
+    queries = [query for query, _, _, _ in test_cases]
+    queries += [' '.join(title.split()[1:]) or title for title in store.columns['title']]
+    parsed = [parse_query(query) for query in queries]
+    embeddings = query_embeddings(embedder, store, [base for _, base, _ in parsed])
+    depth = max(ks)
+
+    def ranked():
+        return [list(indices) for indices, _ in store.engine.top_k_many(embeddings, parsed, depth, -np.inf)]
+
+    full = ranked()
+    passed = run_tests(embedder, store, verbose=False)
+    print(f"{'mode':>7} {'dim':>4} {'bytes/doc':>9} " + ' '.join(f"{'top' + str(k):>6}" for k in ks)
+          + f" {'tests':>6}")
+    print(f"{'full':>7} {store.dim:>4} {8 * store.dim:>9} " + ' '.join(f"{1.0:>6.3f}" for _ in ks)
+          + f" {passed:>3}/{len(test_cases)}")
+    try:
+        for mode in PROJECTIONS:
+            for dim in dims:
+                store.configure(**options, reduce=mode, reduce_dim=dim)
+                reduced = ranked()
+                passed = run_tests(embedder, store, verbose=False)
+                print(f"{mode:>7} {dim:>4} {8 * dim:>9} "
+                      + ' '.join(f"{_agreement(full, reduced, k):>6.3f}" for k in ks)
+                      + f" {passed:>3}/{len(test_cases)}")
+    finally:
+        store.engine_options = options
+        store.touch()
+
+
+if __name__ == '__main__':
+    # 用法: python src/test/projection.py [dim ...]
+    report(dims=tuple(int(arg) for arg in sys.argv[1:]) or REDUCED_DIMS)
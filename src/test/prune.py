@@ -0,0 +1,93 @@
+import sys
+import time
+
+import numpy as np
+
+# 分块读取行, 避免整矩阵的临时副本
+CHUNK = 65536
+
+
+class ProjectionBound:
+    """Per-document upper bounds of q·x from a rank-dim orthonormal projection.
+
+    With P the top principal directions of a sample of the rows, every
+    row splits into x = P xP + x_perp, so for a unit query
+    q·x = qP·xP + q_perp·x_perp <= qP·xP + |q_perp| |x_perp|.
+    Only the dim-column projections and one residual norm per row are
+    stored, so the bounds of the whole corpus cost a dim-wide GEMV
+    instead of the full one. vectors only needs len(), shape and row
+    slicing (e.g. engine.CombinedRows).
+    """
+
+    def __init__(self, vectors, dim=64, train_size=20000, seed=0):
+        n, full_dim = vectors.shape
+        dim = max(1, min(dim, full_dim))
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(n, size=min(n, train_size), replace=False))
+        train = np.asarray(vectors[sample], dtype=np.float32)
+        if len(train):
+            _, _, vt = np.linalg.svd(train, full_matrices=False)
+            basis = vt[:dim]
+        else:
+            basis = np.eye(dim, full_dim, dtype=np.float32)
+        # 样本行数少于 dim 时 SVD 给出的方向不够, 上界对这种情况依然成立
+        self.basis = np.ascontiguousarray(basis.T, dtype=np.float32)
+        self.projected = np.empty((n, self.basis.shape[1]), dtype=np.float32)
+        self.residual = np.empty(n, dtype=np.float32)
+        for start in range(0, n, CHUNK):
+            block = np.asarray(vectors[start:start + CHUNK], dtype=np.float32)
+            projected = block @ self.basis
+            self.projected[start:start + CHUNK] = projected
+            # 基是正交的: |x_perp|^2 = |x|^2 - |xP|^2
+            rest = np.einsum('ij,ij->i', block, block) - np.einsum('ij,ij->i', projected, projected)
+            self.residual[start:start + CHUNK] = np.sqrt(np.maximum(rest, 0.0))
+
+    @property
+    def dim(self):
+        return self.basis.shape[1]
+
+    def scores(self, query):
+        """(approximate scores qP·xP, upper bounds) for every row; query must be unit-norm"""
+        qp = np.asarray(query, dtype=np.float32).ravel() @ self.basis
+        q_rest = np.sqrt(max(1.0 - float(qp @ qp), 0.0))
+        approx = (self.projected @ qp).astype(np.float64)
+        return approx, approx + q_rest * self.residual
+
+
+def benchmark(n=100000, k=3, n_queries=200, noises=(0.5, 1.0, 1.5), dims=(32, 64), min_similarity=0.0,
+              dim=384, seed=0):
+    """Print documents pruned vs scored and latency of prune=True vs the exhaustive scan"""
+    from ann import synthetic_vectors
+    from engine import ScoringEngine, parse_query, result_columns
+
+    metadatas = [{'title': f"RECIPE {i}", 'ingredients': '', 'instructions': ''} for i in range(n)]
+    columns = result_columns(metadatas)
+    parsed = [parse_query(f"query {i}") for i in range(n_queries)]
+    print(f"corpus {n} x {dim}, k={k}, min_similarity={min_similarity}")
+    print(f"{'noise':>5} {'dim':>4} {'scored %':>8} {'pruned %':>8} {'full ms':>8} {'prune ms':>8} {'identical':>9}")
+    for noise in noises:
+        vectors = synthetic_vectors(2 * n + n_queries, dim=dim, noise=noise, seed=seed)
+        doc_matrix, title_matrix, queries = vectors[:n], vectors[n:2 * n], vectors[2 * n:]
+
+        def run(engine):
+            # 先建好惰性结构, 只计查询时间
+            engine.search(queries[:1], parsed[0], k, min_similarity)
+            start = time.perf_counter()
+            results = [engine.search(queries[i:i + 1], parsed[i], k, min_similarity) for i in range(n_queries)]
+            return (time.perf_counter() - start) * 1000 / n_queries, results
+
+        full_ms, expected = run(ScoringEngine(doc_matrix, title_matrix, metadatas, columns=columns, normalized=True))
+        for prune_dim in dims:
+            engine = ScoringEngine(doc_matrix, title_matrix, metadatas, columns=columns, normalized=True,
+                                   prune=True, prune_dim=prune_dim)
+            prune_ms, results = run(engine)
+            stats = engine.pruning_stats
+            total = stats['scored'] + stats['pruned']
+            print(f"{noise:>5} {prune_dim:>4} {100 * stats['scored'] / total:>8.1f} "
+                  f"{100 * stats['pruned'] / total:>8.1f} {full_ms:>8.2f} {prune_ms:>8.2f} "
+                  f"{str(results == expected):>9}")
+
+
+if __name__ == '__main__':
+    # 用法: python src/test/prune.py [n]
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,217 @@
+import sys
+import time
+
+import numpy as np
+
+from ann import synthetic_vectors
+
+# 分块打分, 避免把整个码本一次性转换成 float32
+CHUNK = 8192
+
+
+class _Codes:
+    """Growable code matrix: encode() new rows and append them with amortized O(1) cost"""
+
+    def _init_codes(self, codes):
+        self._codes = codes
+        self._size = len(codes)
+
+    @property
+    def codes(self):
+        return self._codes[:self._size]
+
+    def add(self, vectors):
+        """Encode and append rows with the already fitted parameters"""
+        codes = self.encode(vectors)
+        if self._size + len(codes) > len(self._codes):
+            # 容量翻倍; 第一次追加时也把 mmap 打开的只读码本复制到内存
+            capacity = max(16, 2 * len(self._codes), self._size + len(codes))
+            grown = np.empty((capacity, self._codes.shape[1]), dtype=self._codes.dtype)
+            grown[:self._size] = self._codes[:self._size]
+            self._codes = grown
+        self._codes[self._size:self._size + len(codes)] = codes
+        self._size += len(codes)
+
+    def __len__(self):
+        return self._size
+
+
+class Int8Quantizer(_Codes):
+    """Per-dimension scaled int8 codes; 1 byte per dimension.
+
+    vectors only needs len(), shape and row slicing, so it can be a
+    memory-mapped matrix or engine.CombinedRows; it is read in CHUNK-row
+    blocks (twice: once for the scale, once for the codes).
+    """
+
+    def __init__(self, vectors):
+        n, dim = vectors.shape
+        scale = np.zeros(dim, dtype=np.float32)
+        for start in range(0, n, CHUNK):
+            block = np.asarray(vectors[start:start + CHUNK], dtype=np.float32)
+            np.maximum(scale, np.abs(block).max(axis=0), out=scale)
+        scale /= 127.0
+        scale[scale == 0] = 1.0
+        self.scale = scale
+        self._init_codes(self.encode(vectors))
+
+    @classmethod
+    def from_arrays(cls, codes, scale):
+        quantizer = cls.__new__(cls)
+        quantizer.scale = scale
+        quantizer._init_codes(codes)
+        return quantizer
+
+    def arrays(self):
+        """Arrays that from_arrays() rebuilds this quantizer from"""
+        return {'codes': self.codes, 'scale': self.scale}
+
+    def encode(self, vectors):
+        # 建好之后追加的行可能超出原来的范围, 截断到 int8
+        codes = np.empty(vectors.shape, dtype=np.int8)
+        for start in range(0, len(codes), CHUNK):
+            block = np.asarray(vectors[start:start + CHUNK], dtype=np.float32)
+            codes[start:start + CHUNK] = np.clip(np.round(block / self.scale), -127, 127)
+        return codes
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.scale.nbytes
+
+    def scores(self, query, ids=None):
+        """Approximate dot products of query with the (optionally selected) rows"""
+        q = np.asarray(query, dtype=np.float32).ravel() * self.scale
+        codes = self.codes if ids is None else self.codes[ids]
+        out = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), CHUNK):
+            out[start:start + CHUNK] = codes[start:start + CHUNK].astype(np.float32) @ q
+        return out
+
+
+def _kmeans(x, n_clusters, n_iter, rng):
+    """Plain (euclidean) k-means, returns the centroids"""
+    centroids = x[rng.choice(len(x), size=n_clusters, replace=len(x) < n_clusters)].copy()
+    for _ in range(n_iter):
+        dist = (x * x).sum(1)[:, None] - 2 * x @ centroids.T + (centroids * centroids).sum(1)[None, :]
+        labels = np.argmin(dist, axis=1)
+        counts = np.bincount(labels, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, x)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+def default_subspaces(dim):
+    """About 8 dims per sub-space: the largest divisor of dim that is <= dim // 8 (48 for 384)"""
+    for n_subspaces in range(max(1, dim // 8), 0, -1):
+        if dim % n_subspaces == 0:
+            return n_subspaces
+    return 1
+
+
+class ProductQuantizer(_Codes):
+    """Product quantization with 256 centroids per sub-space (1 byte per sub-space).
+
+    Dot products are computed from a per-query lookup table of
+    sub-vector x centroid products. The codebooks are trained on a sample
+    of train_size rows and the codes are assigned CHUNK rows at a time,
+    so vectors may be a memory-mapped matrix or engine.CombinedRows.
+    """
+
+    def __init__(self, vectors, n_subspaces=None, n_iter=8, train_size=20000, seed=0):
+        n, dim = vectors.shape
+        if n_subspaces is None:
+            n_subspaces = default_subspaces(dim)
+        if dim % n_subspaces:
+            raise ValueError(f"dimension {dim} is not divisible by {n_subspaces} sub-spaces")
+        sub_dim = dim // n_subspaces
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(n, size=min(n, train_size), replace=False))
+        train = np.asarray(vectors[sample], dtype=np.float32)
+
+        self.codebooks = np.empty((n_subspaces, 256, sub_dim), dtype=np.float32)
+        for j in range(n_subspaces):
+            self.codebooks[j] = _kmeans(train[:, j * sub_dim:(j + 1) * sub_dim], 256, n_iter, rng)
+        self._init_codes(self.encode(vectors))
+
+    @classmethod
+    def from_arrays(cls, codes, codebooks):
+        quantizer = cls.__new__(cls)
+        quantizer.codebooks = codebooks
+        quantizer._init_codes(codes)
+        return quantizer
+
+    def arrays(self):
+        """Arrays that from_arrays() rebuilds this quantizer from"""
+        return {'codes': self.codes, 'codebooks': self.codebooks}
+
+    @property
+    def n_subspaces(self):
+        return self.codebooks.shape[0]
+
+    @property
+    def sub_dim(self):
+        return self.codebooks.shape[2]
+
+    def encode(self, vectors):
+        codes = np.empty((len(vectors), self.n_subspaces), dtype=np.uint8)
+        norms = (self.codebooks * self.codebooks).sum(axis=2)
+        for start in range(0, len(codes), CHUNK):
+            block = np.asarray(vectors[start:start + CHUNK], dtype=np.float32)
+            for j, book in enumerate(self.codebooks):
+                x = block[:, j * self.sub_dim:(j + 1) * self.sub_dim]
+                dist = -2 * x @ book.T + norms[j][None, :]
+                codes[start:start + CHUNK, j] = np.argmin(dist, axis=1)
+        return codes
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.codebooks.nbytes
+
+    def lookup_table(self, query):
+        q = np.asarray(query, dtype=np.float32).reshape(self.n_subspaces, self.sub_dim)
+        return np.einsum('md,mkd->mk', q, self.codebooks)
+
+    def scores(self, query, ids=None):
+        lut = self.lookup_table(query)
+        codes = self.codes if ids is None else self.codes[ids]
+        out = np.empty(len(codes), dtype=np.float32)
+        subspaces = np.arange(self.n_subspaces)
+        for start in range(0, len(codes), CHUNK):
+            out[start:start + CHUNK] = lut[subspaces, codes[start:start + CHUNK]].sum(axis=1)
+        return out
+
+
+QUANTIZERS = {'int8': Int8Quantizer, 'pq': ProductQuantizer}
+
+
+def benchmark(n=100000, k=3, rerank=(10, 50, 200), n_queries=200, dim=384, seed=0):
+    """Print memory, latency and recall@k after exact re-ranking for each quantizer"""
+    vectors = synthetic_vectors(n + n_queries, dim=dim, seed=seed)
+    vectors, queries = vectors[:n], vectors[n:]
+    start = time.perf_counter()
+    exact = [set(np.argpartition(-(vectors @ q), k - 1)[:k]) for q in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / n_queries
+    print(f"float32: {vectors.nbytes / n:.0f} bytes/vector, exact scan {exact_ms:.3f} ms/query")
+    print(f"{'mode':>5} {'bytes/vec':>9} {'build s':>8} {'rerank':>6} {'ms/query':>9} {'recall@' + str(k):>9}")
+    for name, quantizer_cls in QUANTIZERS.items():
+        start = time.perf_counter()
+        quantizer = quantizer_cls(vectors)
+        build = time.perf_counter() - start
+        for pool in rerank:
+            start = time.perf_counter()
+            found = []
+            for q in queries:
+                approx = quantizer.scores(q)
+                ids = np.argpartition(-approx, pool - 1)[:pool]
+                top = ids[np.argpartition(-(vectors[ids] @ q), k - 1)[:k]]
+                found.append(set(top))
+            ms = (time.perf_counter() - start) * 1000 / n_queries
+            recall = np.mean([len(f & e) / k for f, e in zip(found, exact)])
+            print(f"{name:>5} {quantizer.nbytes / n:>9.1f} {build:>8.2f} {pool:>6} {ms:>9.3f} {recall:>9.3f}")
+
+
+if __name__ == '__main__':
+    # 用法: python src/test/quantize.py [n]
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,279 @@
+import sys
+from collections.abc import Sequence
+
+import numpy as np
+
+from engine import MISSING, CombinedRows, ScoringEngine, VersionedIndex, full_text, normalize_rows
+from projection import PROJECTIONS
+from quantize import QUANTIZERS
+from sharded import ShardedEngine
+
+# recipes.json 中每个食谱的字段
+FIELDS = ['title', 'serving_size', 'notes', 'ingredients', 'instructions']
+
+
+def document_text(recipe):
+    """Text that is encoded as a recipe's document embedding"""
+    return f"{recipe['title']}\n{recipe['instructions']}\n{recipe['ingredients']}"
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class RecipeRow:
+    """Read-only view of one RecipeStore row with the old vector_store entry keys"""
+
+    __slots__ = ('_store', '_index')
+
+    KEYS = ('text', 'embedding', 'title_embedding', 'metadata')
+
+    def __init__(self, store, index):
+        self._store = store
+        self._index = index
+
+    def __getitem__(self, key):
+        store, i = self._store, self._index
+        if key == 'embedding':
+            return store.doc_matrix[i]
+        if key == 'title_embedding':
+            return store.title_matrix[i]
+        if key == 'metadata':
+            return store.metadata(i)
+        if key == 'text':
+            # 与原 vector_store 中的 text 一致, 按需拼接而不是常驻内存
+            return f"{store.columns['title'][i]}\n{store.columns['instructions'][i]}\n{store.columns['ingredients'][i]}"
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self.KEYS
+
+    def __contains__(self, key):
+        return key in self.KEYS
+
+    def __repr__(self):
+        return f"RecipeRow({self._index}, {self._store.columns['title'][self._index]!r})"
+
+
+class _MetadataView(Sequence):
+    """Sequence of per-row metadata dicts built on demand"""
+
+    __slots__ = ('_store',)
+
+    def __init__(self, store):
+        self._store = store
+
+    def __len__(self):
+        return len(self._store)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._store.metadata(j) for j in range(*i.indices(len(self)))]
+        return self._store.metadata(i)
+
+
+class RecipeStore(VersionedIndex):
+    """Columnar vector store: contiguous embedding matrices plus per-field columns.
+
+    Strings are interned once per column and the strings search() returns
+    for each attribute are precomputed, so results are list lookups. Rows
+    are exposed as RecipeRow views, so code written against the old
+    list-of-dicts vector_store (``doc['metadata']['title']``) keeps working.
+    Embeddings are L2-normalized on insert, which leaves cosine scores
+    unchanged and lets the engine use the matrices without copying them.
+
+    A store from reduced() holds projected matrices plus the fitted
+    ``projection``; queries and added embeddings keep the model's full
+    dimension (query_dim) and are projected on the way in.
+
+    quantizer(mode) builds the int8 / PQ codes of the combined rows once
+    per store (or they are loaded with the index, see persist.py); add()
+    appends the new row's codes instead of rebuilding them, and engines
+    built for configure(quantize=...) share them.
+    """
+
+    def __init__(self, dim=0, capacity=0):
+        self._init_versioning()
+        self._size = 0
+        self._doc = np.zeros((capacity, dim), dtype=np.float32)
+        self._title = np.zeros((capacity, dim), dtype=np.float32)
+        self.columns = {field: [] for field in FIELDS}
+        self.extras = []
+        self.projection = None
+        # 按模式缓存的量化码本, 引擎重建时不再重新量化
+        self.quantizers = {}
+        # search() 的结果列: None 为完整文本, 属性列直接复用字段列
+        self.results = {None: []}
+        for field in ('ingredients', 'instructions', 'notes', 'serving_size'):
+            self.results[field] = self.columns[field]
+
+    @classmethod
+    def from_recipes(cls, recipes, doc_embeddings, title_embeddings):
+        doc_embeddings = np.asarray(doc_embeddings, dtype=np.float32)
+        title_embeddings = np.asarray(title_embeddings, dtype=np.float32)
+        store = cls(dim=doc_embeddings.shape[-1] if doc_embeddings.size else 0, capacity=len(recipes))
+        for recipe, embedding, title_embedding in zip(recipes, doc_embeddings, title_embeddings):
+            store._add(recipe, embedding, title_embedding)
+        store.touch()
+        return store
+
+    @classmethod
+    def from_matrices(cls, recipes, doc_matrix, title_matrix):
+        """Wrap already L2-normalized matrices (e.g. np.load(..., mmap_mode='r')) without copying"""
+        if len(doc_matrix) != len(recipes) or len(title_matrix) != len(recipes):
+            raise ValueError("matrices and recipes have different lengths")
+        store = cls()
+        store._doc = doc_matrix
+        store._title = title_matrix
+        for recipe in recipes:
+            store._add_columns(recipe)
+        store._size = len(recipes)
+        store.touch()
+        return store
+
+    @classmethod
+    def from_vector_store(cls, vector_store):
+        """Convert a list-of-dicts vector_store"""
+        docs = list(vector_store)
+        return cls.from_recipes(
+            [doc['metadata'] for doc in docs],
+            [doc['embedding'] for doc in docs],
+            [doc['title_embedding'] for doc in docs],
+        )
+
+    @property
+    def doc_matrix(self):
+        return self._doc[:self._size]
+
+    @property
+    def title_matrix(self):
+        return self._title[:self._size]
+
+    @property
+    def dim(self):
+        return self._doc.shape[1]
+
+    @property
+    def query_dim(self):
+        """Dimension of the embeddings this store is searched with"""
+        return self.projection.input_dim if self.projection is not None else self.dim
+
+    def quantizer(self, mode):
+        """Quantized codes of the combined title/doc rows (see quantize.QUANTIZERS), built once"""
+        if mode not in QUANTIZERS:
+            raise ValueError(f"unknown quantize mode: {mode!r}")
+        if mode not in self.quantizers:
+            self.quantizers[mode] = QUANTIZERS[mode](CombinedRows(self.doc_matrix, self.title_matrix))
+        return self.quantizers[mode]
+
+    def reduced(self, mode, dim):
+        """Copy of this store with both matrices projected to dim dimensions.
+
+        The projection (see projection.PROJECTIONS) is fitted on the doc and
+        title matrices, and the reduced rows are re-normalized.
+        """
+        if mode not in PROJECTIONS:
+            raise ValueError(f"unknown reduce mode: {mode!r}")
+        if self.projection is not None:
+            raise ValueError("store is already reduced")
+        projection = PROJECTIONS[mode](np.concatenate([self.doc_matrix, self.title_matrix]), dim)
+        store = RecipeStore.from_matrices(
+            [self.metadata(i) for i in range(len(self))],
+            normalize_rows(projection.transform(self.doc_matrix)),
+            normalize_rows(projection.transform(self.title_matrix)),
+        )
+        store.projection = projection
+        store.title_trie = self.title_trie
+        return store
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [RecipeRow(self, j) for j in range(*i.indices(self._size))]
+        if i < 0:
+            i += self._size
+        if not 0 <= i < self._size:
+            raise IndexError("RecipeStore index out of range")
+        return RecipeRow(self, i)
+
+    def __iter__(self):
+        return (RecipeRow(self, i) for i in range(self._size))
+
+    def metadata(self, i):
+        """The recipe dict of row i, rebuilt from the columns"""
+        recipe = {}
+        for field in FIELDS:
+            value = self.columns[field][i]
+            if value is not MISSING:
+                recipe[field] = value
+        if self.extras[i]:
+            recipe.update(self.extras[i])
+        return recipe
+
+    def metadatas(self):
+        return _MetadataView(self)
+
+    def _grow(self, dim):
+        if self._doc.shape[1] != dim:
+            if self._size:
+                raise ValueError(f"embedding dimension {dim} does not match store dimension {self.dim}")
+            self._doc = np.zeros((0, dim), dtype=np.float32)
+            self._title = np.zeros((0, dim), dtype=np.float32)
+        if self._size == len(self._doc):
+            # 容量翻倍, 追加的均摊成本为 O(1)
+            capacity = max(16, 2 * len(self._doc))
+            for name in ('_doc', '_title'):
+                grown = np.zeros((capacity, dim), dtype=np.float32)
+                grown[:self._size] = getattr(self, name)[:self._size]
+                setattr(self, name, grown)
+
+    def _add(self, recipe, embedding, title_embedding):
+        if self.projection is not None:
+            # 与建库时相同: 先归一化, 投影后再归一化
+            embedding = self.projection.transform(normalize_rows(embedding))
+            title_embedding = self.projection.transform(normalize_rows(title_embedding))
+        embedding = normalize_rows(embedding)[0]
+        self._grow(embedding.shape[0])
+        self._doc[self._size] = embedding
+        self._title[self._size] = normalize_rows(title_embedding)[0]
+        self._add_columns(recipe)
+        self._size += 1
+
+    def _add_columns(self, recipe):
+        for field in FIELDS:
+            self.columns[field].append(_intern(recipe.get(field, MISSING)))
+        extra = {key: value for key, value in recipe.items() if key not in FIELDS}
+        self.extras.append(extra or None)
+        self.results[None].append(_intern(full_text(recipe)))
+
+    def add(self, recipe, embedding, title_embedding):
+        self._add(recipe, embedding, title_embedding)
+        for quantizer in self.quantizers.values():
+            quantizer.add(CombinedRows(self.doc_matrix, self.title_matrix)[-1:])
+        if self.title_trie is not None:
+            self.title_trie.insert(recipe['title'])
+        self.touch()
+
+    def append(self, entry):
+        """Append an old-style {'embedding', 'title_embedding', 'metadata'} entry"""
+        self.add(entry['metadata'], entry['embedding'], entry['title_embedding'])
+
+    def build_engine(self, **options):
+        # configure(shards=N): 行分片到 N 个工作进程并行打分
+        shards = options.pop('shards', None)
+        if self.projection is not None:
+            options['projection'] = self.projection
+        if shards:
+            return ShardedEngine.from_store(self, shards, **options)
+        if options.get('quantize') and not options.get('reduce'):
+            options['quantizer'] = self.quantizer(options['quantize'])
+        return ScoringEngine(self.doc_matrix, self.title_matrix, self.metadatas(),
+                             columns=self.results, normalized=True, **options)
@@ -1,34 +1,211 @@
-from sklearn.metrics.pairwise import cosine_similarity
-import numpy as np
 import json
+import os
 import re
-from sentence_transformers import SentenceTransformer
+import threading
+
+# 本模块导入时没有副作用: 模型、语料和索引在第一次通过
+# get_embedder() / get_vector_store() (或访问 embedder / vector_store) 时才加载.
+# numpy 和 sentence_transformers 也延迟到函数内部导入, 使 import 只需几毫秒.
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+# RECIPE_EMBEDDER=hashing 使用离线的哈希向量 (无需下载模型, 用于测试和基准)
+EMBEDDER_BACKEND = os.environ.get('RECIPE_EMBEDDER', 'sentence-transformers')
+# RECIPE_REDUCE=pca:128 (或 random:64 等) 时建库保存降维后的向量, 查询时用同一投影
+# RECIPE_QUANTIZE=int8 (或 pq, 或 int8,pq) 时建库同时构建并保存量化码本
+# 这两个变量在建库时才读取和校验 (index_reduce() / index_quantize())
+# 设置 RECIPE_SHARED_INDEX=<name> 时, 索引从 shared_store.py --publish 发布的共享内存读取
+RECIPES_PATH = "data/recipes.json"
+INDEX_DIR = "data/index"
+EMBEDDING_CACHE = "data/embeddings.sqlite"
+
+
+def parse_reduce(value):
+    """'pca:128' -> ('pca', 128); 'random' -> ('random', 128); '' or None -> None.
+
+    Raises ValueError for an unknown mode or a dimension that is not a
+    positive integer.
+    """
+    from projection import PROJECTIONS
+
+    if not value:
+        return None
+    mode, _, dim = value.partition(':')
+    if mode not in PROJECTIONS:
+        raise ValueError(f"unknown reduce mode in {value!r}")
+    if dim and not (dim.isdigit() and int(dim) > 0):
+        raise ValueError(f"reduce dimension in {value!r} is not a positive integer")
+    return (mode, int(dim or 128))
+
+def index_reduce():
+    """Reduction of the default index from RECIPE_REDUCE (see parse_reduce())"""
+    return parse_reduce(os.environ.get('RECIPE_REDUCE'))
+
+def index_quantize():
+    """Quantize modes whose codes are saved with the default index, from RECIPE_QUANTIZE"""
+    from quantize import QUANTIZERS
+
+    modes = tuple(mode for mode in os.environ.get('RECIPE_QUANTIZE', '').split(',') if mode)
+    for mode in modes:
+        if mode not in QUANTIZERS:
+            raise ValueError(f"unknown quantize mode: {mode!r}")
+    return modes
 
 # Start your code here
 # This is an outline, you can try any techniques you like.
 # Please pay attention to the variable naming requirements below!
+_init_lock = threading.RLock()
+_state = {}
 
 # Step 0: Load recipes
-with open("data/recipes.json", encoding="utf-8") as f:
-    recipe_data = json.load(f)
+def get_recipe_data():
+    with _init_lock:
+        if 'recipe_data' not in _state:
+            with open(RECIPES_PATH, encoding="utf-8") as f:
+                _state['recipe_data'] = json.load(f)
+        return _state['recipe_data']
 
 # Step 1: Create vector store
-embedder = SentenceTransformer('all-MiniLM-L6-v2') # don't change the name of this variable! 
-vector_store = list()                              # don't change the name of this variable! 
-
-for recipe in recipe_data:
-    # Append embeddings and recipe data to the vector_store list
-    text = f"{recipe['title']}\n{recipe['instructions']}\n{recipe['ingredients']}"
-    embedding = embedder.encode(text, convert_to_numpy=True)
-    vector_store.append({
-        "text": text,
-        "embedding": embedding,
-        "metadata": recipe
-    })
+def get_embedder():
+    with _init_lock:
+        if 'embedder' not in _state:
+            if EMBEDDER_BACKEND == 'hashing':
+                from embedders import HashingEmbedder
+                _state['embedder'] = HashingEmbedder()
+            elif EMBEDDER_BACKEND == 'sentence-transformers':
+                from sentence_transformers import SentenceTransformer
+                embedder = SentenceTransformer(MODEL_NAME)
+                # 稳定的模型名: 持久化的向量缓存和索引中的标题树都以它为键
+                embedder.name = MODEL_NAME
+                # 补上 dim, 使其满足 embedders.Embedder 协议
+                embedder.dim = embedder.get_sentence_embedding_dimension()
+                _state['embedder'] = embedder
+            else:
+                raise ValueError(f"unknown embedder backend {EMBEDDER_BACKEND!r}")
+        return _state['embedder']
+
+def index_model_name():
+    """Model name recorded in (and checked against) the on-disk index"""
+    return MODEL_NAME if EMBEDDER_BACKEND == 'sentence-transformers' else get_embedder().name
+
+def build_vector_store(embedder, recipe_data, cache=None, batch_size=32, processes=0, model=None, verbose=False):
+    """Encode recipe_data into a RecipeStore.
+
+    model names the embedder in the persistent cache and the title trie
+    (default: its own stable name; required for a cache when it has none).
+    verbose=True prints the encode throughput.
+    """
+    from batch_encoder import BatchEncoder
+    from caches import model_key
+    from embedding_cache import CachedEmbedder
+    from recipe_store import RecipeStore, document_text
+    from title_trie import TitleTrie
+
+    # 按长度排序分批编码 (可选多进程), 代替逐条调用 encode
+    encoder = BatchEncoder(embedder, batch_size=batch_size, processes=processes)
+    embedder = encoder
+    if cache is not None:
+        # 持久化向量缓存: 只批量编码文本有变化的食谱
+        embedder = CachedEmbedder(encoder, cache, model)
+
+    # Encode title + instructions + ingredients of every recipe
+    doc_embeddings = embedder.encode([document_text(recipe) for recipe in recipe_data])
+    if verbose and encoder.last_count:
+        print(f"encoded {encoder.last_count} recipes in {encoder.last_seconds:.2f}s ({encoder.rate:.1f} recipes/s)")
+
+    # 标题向量在建库时一次性批量编码并归一化, 查询时不再逐条调用模型
+    title_embeddings = embedder.encode(
+        [recipe['title'] for recipe in recipe_data],
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+    )
+
+    # 列式存储: 连续的向量矩阵 + 按字段的字符串列, 行以轻量视图的形式访问
+    store = RecipeStore.from_recipes(recipe_data, doc_embeddings, title_embeddings)
+
+    # 标题前缀树: 自动补全, 以及精确标题查询不调用模型的快速路径
+    store.title_trie = TitleTrie.build((recipe['title'] for recipe in recipe_data), embedder,
+                                       model if model is not None else model_key(encoder.embedder))
+    encoder.close()
+    return store
+
+def open_vector_store(embedder, recipe_data, model, index_dir=INDEX_DIR, cache_path=EMBEDDING_CACHE,
+                      reduce=None, quantize=(), verbose=False):
+    """Open the saved index for recipe_data, rebuilding and saving it when stale.
+
+    reduce=(mode, dim) builds and saves a reduced-dimension index (see
+    RecipeStore.reduced()) instead of the full-dimension one. quantize
+    lists the modes ('int8', 'pq') whose codes are built and saved with
+    the index, so configure(quantize=...) does not re-quantize per process.
+    verbose=True prints encode and embedding-cache statistics on a rebuild.
+    """
+    from embedding_cache import EmbeddingCache
+    from persist import IndexMismatchError, corpus_checksum, load_index, save_index
+
+    # 优先 mmap 打开磁盘上的索引; 模型、语料或降维设置变化时重新编码并保存
+    try:
+        return load_index(index_dir, model=model, checksum=corpus_checksum(recipe_data), reduce=reduce,
+                          quantize=quantize)
+    except (FileNotFoundError, IndexMismatchError):
+        with EmbeddingCache(cache_path) as cache:
+            store = build_vector_store(embedder, recipe_data, cache=cache, model=model, verbose=verbose)
+            if verbose:
+                print(f"embedding cache: {cache.hits} hits, {cache.misses} misses")
+        if reduce:
+            store = store.reduced(*reduce)
+        save_index(store, index_dir, model, quantize)
+        return store
+
+def get_vector_store():
+    with _init_lock:
+        if 'vector_store' not in _state:
+            shared = os.environ.get('RECIPE_SHARED_INDEX')
+            if shared:
+                # 多进程部署: 零拷贝挂接加载进程放进共享内存的索引
+                from shared_store import SharedIndex
+                _state['shared_index'] = SharedIndex.attach(shared)
+                _state['vector_store'] = _state['shared_index'].store
+            else:
+                _state['vector_store'] = open_vector_store(get_embedder(), get_recipe_data(), index_model_name(),
+                                                           reduce=index_reduce(), quantize=index_quantize())
+        return _state['vector_store']
+
+def warm_up():
+    """加载模型和索引, 让第一个查询不必等待"""
+    return get_embedder(), get_vector_store()
+
+_LAZY = {
+    'recipe_data': get_recipe_data,
+    'embedder': get_embedder,          # don't change the name of this variable!
+    'vector_store': get_vector_store,  # don't change the name of this variable!
+}
+
+def __getattr__(name):
+    # 兼容 `from search_function import embedder, vector_store`
+    if name in _LAZY:
+        return _LAZY[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def query_embeddings(embedder, vector_store, base_queries):
+    """查询向量: 精确标题直接取前缀树中预先编码的向量, 其余走查询向量缓存"""
+    import numpy as np
+    from caches import query_embedding_cache
+
+    trie = getattr(vector_store, 'title_trie', None)
+    found = [trie.query_embedding(embedder, q) if trie is not None else None for q in base_queries]
+    missing = [q for q, embedding in zip(base_queries, found) if embedding is None]
+    if missing:
+        encoded = iter(query_embedding_cache.encode(embedder, missing))
+        found = [embedding if embedding is not None else next(encoded) for embedding in found]
+    return np.array(found, dtype=np.float32)
+
+def autocomplete(vector_store, prefix, n=10):
+    """返回以 prefix 开头的前 n 个食谱标题"""
+    trie = getattr(vector_store, 'title_trie', None)
+    return trie.complete(prefix, n) if trie is not None else []
 
 # Step 2 - write search function
 # don't rename this function! It's required for the testing code.
-def search(embedder, vector_store, query, k, min_similarity):
+def search(embedder, vector_store, query, k, min_similarity, filters=None):
     """
     根据查询中的属性返回相应的内容:
     - ingredients: 返回ingredients
@@ -43,84 +220,95 @@ def search(embedder, vector_store, query, k, min_similarity):
     query - 搜索查询
     k - 返回结果数量
     min_similarity - 最小相似度阈值
+    filters - 可选的结构化过滤条件, 例如
+              {'serving_size': (8, 12), 'has': 'notes', 'category': 'cakes'}
+              (见 filters.filter_key), 在取前 k 个之前作用于分数
     
     返回:
     list - 相关文档或属性列表
     """
+    from caches import search_result_cache
+    from engine import VersionedIndex, get_engine, index_version, parse_query
+    from filters import filter_key
+
+    # 结果缓存: 键中带有索引版本, vector_store 重建或修改后自动失效.
+    # 普通 list 的原地修改无法检测, 不缓存其结果
+    cache_key = None
+    if isinstance(vector_store, VersionedIndex):
+        cache_key = search_result_cache.make_key(
+            embedder, query, k, min_similarity, index_version(vector_store), filter_key(filters)
+        )
+        cached = search_result_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
     # 解析查询中的属性
-    query_lower = query.lower()
-    attribute = None
-    
-    # 检查查询是否包含属性
-    attributes = ['ingredients', 'instructions', 'notes', 'serving size']
-    base_query = query_lower
-    
-    for attr in attributes:
-        if query_lower.endswith(' ' + attr):
-            attribute = attr.replace(' ', '_')  # 处理'serving size'的情况
-            base_query = query_lower[:-len(' ' + attr)].strip()
-            break
-    
-    # 获取查询的嵌入向量
-    query_embedding = embedder.encode(base_query, convert_to_numpy=True).reshape(1, -1)
-    
-    # 计算所有文档的相似度得分
-    results_with_scores = []
-    
-    for doc in vector_store:
-        # 计算标题的相似度
-        title = doc['metadata']['title']
-        title_lower = title.lower()
-        query_tokens = [token for token in query.lower().strip().split() if token]
-
-        title_embedding = embedder.encode(title, convert_to_numpy=True).reshape(1, -1)
-        title_similarity = float(cosine_similarity(query_embedding, title_embedding)[0][0])
-        # print(title_similarity)
-        # 计算文档内容的相似度
-        doc_embedding = doc['embedding'].reshape(1, -1)
-        doc_similarity = float(cosine_similarity(query_embedding, doc_embedding)[0][0])
-        # print(doc_similarity)
-        # 计算最终相似度分数
-        similarity = title_similarity * 0.15 + doc_similarity * 0.85
-        # 如果 query 的 token 有出现在 title 的 token 中，加分
-        match_count = sum(token in title_lower for token in query_tokens)
-        similarity += match_count * 0.2
-
-        results_with_scores.append((similarity, doc))
-
-
-    # 按相似度降序排序
-    results_with_scores.sort(reverse=True, key=lambda x: x[0])
-    # 筛选相似度高于阈值的结果
-    filtered_results = [(score, doc) for score, doc in results_with_scores if score >= min_similarity]
-
-    # 如果没有找到匹配的文档
-    if not filtered_results:
-        return ['No matching documents!']
-    
-    # 获取前k个结果
-    top_k_results = filtered_results[:k]
-    
-    # 根据属性返回结果
-    final_results = []
-    for _, doc in top_k_results:
-        if attribute:
-            # 如果请求特定属性
-            if attribute in doc['metadata']:
-                final_results.append(doc['metadata'][attribute])
-        else:
-            # 如果没有指定属性,返回完整文本
-            title = doc['metadata']['title']
-            ingredients = doc['metadata'].get('ingredients', '')
-            instructions = doc['metadata'].get('instructions', '')
-            full_text = f"{title}\n{ingredients}\n{instructions}".strip()
-            final_results.append(full_text)
-    
-    # 如果没有结果,返回No matching documents
-    if not final_results:
-        return ['No matching documents!']
-        
-    return final_results
+    parsed_query = parse_query(query)
+    _, base_query, _ = parsed_query
+
+    # 获取查询的嵌入向量 (精确标题不调用模型, 相同查询只编码一次)
+    query_embedding = query_embeddings(embedder, vector_store, [base_query])
+
+    # 对整个语料做矩阵打分, 用 argpartition 取前 k 个
+    engine = get_engine(vector_store)
+    results = engine.search(query_embedding, parsed_query, k, min_similarity, filters)
+    if cache_key is not None:
+        search_result_cache.put(cache_key, results)
+    return results
+
+def search_many(embedder, vector_store, queries, k, min_similarity):
+    """
+    批量版本的 search(): 所有查询一次 encode, 一次矩阵乘法打分.
+    返回值与对每个查询循环调用 search() 相同.
+
+    返回:
+    list - 每个查询对应一个结果列表
+    """
+    return search_requests(embedder, vector_store, [(query, k, min_similarity) for query in queries])
+
+def search_requests(embedder, vector_store, requests):
+    """
+    search_many() 的一般形式: requests 为 (query, k, min_similarity) 列表,
+    各请求的 k 和阈值可以不同. 所有未命中缓存的查询一起 encode,
+    相同 (k, min_similarity) 的查询一起打分.
+    """
+    import numpy as np
+    from caches import search_result_cache
+    from engine import VersionedIndex, get_engine, index_version, parse_query
+
+    # 与 search() 相同: 普通 list 不缓存结果
+    if isinstance(vector_store, VersionedIndex):
+        version = index_version(vector_store)
+        cache_keys = [
+            search_result_cache.make_key(embedder, query, k, min_similarity, version)
+            for query, k, min_similarity in requests
+        ]
+        results = [search_result_cache.get(key) for key in cache_keys]
+    else:
+        cache_keys = [None] * len(requests)
+        results = [None] * len(requests)
+    pending = [i for i, cached in enumerate(results) if cached is None]
+    if not pending:
+        return results
+
+    parsed_queries = {i: parse_query(requests[i][0]) for i in pending}
+    embeddings = query_embeddings(
+        embedder, vector_store, [parsed_queries[i][1] for i in pending]
+    )
+    rows = dict(zip(pending, embeddings))
+    groups = {}
+    for i in pending:
+        groups.setdefault(requests[i][1:], []).append(i)
+    engine = get_engine(vector_store)
+    for (k, min_similarity), ids in groups.items():
+        fresh = engine.search_many(
+            np.array([rows[i] for i in ids]), [parsed_queries[i] for i in ids], k, min_similarity
+        )
+        for i, result in zip(ids, fresh):
+            if cache_keys[i] is not None:
+                search_result_cache.put(cache_keys[i], result)
+            results[i] = result
+    return results
 
 def normalize(text):
     return re.sub(r'\s+', ' ', text.strip())
@@ -146,30 +334,38 @@ test_cases = [
               ('cinnamon doughnuts ingredients', 0, 'ingredients', '2 cups Bisquick\n¼ cup sugar\n⅓ cup milk\n1 tsp. vanilla\n1 egg\n¼ tsp. each cinnamon\nnutmeg, if desired'),
               ('pineapple buns', 0, 'text', 'PINEAPPLE STICKY BUNS ¾ cup drained crushed pineapple\n½ cup soft butter\n½ cup brown sugar (packed)\n1 tsp. cinnamon Heat oven to 425° (hot). Mix ingredients and divide among 12 large greased muffin cups. Make Fruit Shortcake dough (p. 3). Spoon over pineapple mixture. Bake 15 to 20 min. Invert on tray or rack immediately to prevent sticking to pans.')
               ]
-score = 0
-for (query, k_index, detail, expected_result) in test_cases:
-  results = search(embedder, vector_store, query, k=k, min_similarity=min_similarity)#, verbose=False)
-  print(f'Test case: "{query}"')
-  try:
-    result = normalize(results[k_index])
-    expected_result = normalize(expected_result)
-    if result == expected_result:
-      score += 1
-      print('PASSED')
-    else:
-      print(f'FAILED: returned incorrect {detail}')
-      print('Returned: ', result)
-      print('Expected: ', expected_result)
-  except AttributeError:
-    if results[k_index] == expected_result:
-      score += 1
-      print('PASSED')
-    else:
-      print(f'FAILED: returned incorrect serving size')
-      print('Returned: ', results[k_index])
-      print('Expected: ', expected_result)
-  except IndexError:
-      result_str = 'results' if k_index > 1 else 'result'
-      print(f'FAILED: the query "{query}" returned less than {k_index+1} {result_str}')
-  print('------')
-print(f'Score: {score}/{len(test_cases)}')
\ No newline at end of file
+def run_tests(embedder=None, vector_store=None, verbose=True):
+    if embedder is None or vector_store is None:
+        embedder, vector_store = warm_up()
+    log = print if verbose else (lambda *args: None)
+    score = 0
+    for (query, k_index, detail, expected_result) in test_cases:
+      results = search(embedder, vector_store, query, k=k, min_similarity=min_similarity)#, verbose=False)
+      log(f'Test case: "{query}"')
+      try:
+        result = normalize(results[k_index])
+        expected_result = normalize(expected_result)
+        if result == expected_result:
+          score += 1
+          log('PASSED')
+        else:
+          log(f'FAILED: returned incorrect {detail}')
+          log('Returned: ', result)
+          log('Expected: ', expected_result)
+      except AttributeError:
+        if results[k_index] == expected_result:
+          score += 1
+          log('PASSED')
+        else:
+          log(f'FAILED: returned incorrect serving size')
+          log('Returned: ', results[k_index])
+          log('Expected: ', expected_result)
+      except IndexError:
+          result_str = 'results' if k_index > 1 else 'result'
+          log(f'FAILED: the query "{query}" returned less than {k_index+1} {result_str}')
+      log('------')
+    log(f'Score: {score}/{len(test_cases)}')
+    return score
+
+if __name__ == '__main__':
+    run_tests()
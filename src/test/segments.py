@@ -0,0 +1,256 @@
+import heapq
+import itertools
+import threading
+
+import numpy as np
+
+from engine import MISSING, NO_MATCH, VersionedIndex
+from recipe_store import RecipeStore, document_text
+
+
+# 自动合并时, 前一个段不超过已合并尾部的这么多倍就一起合并
+MERGE_FACTOR = 2
+
+
+class Segment:
+    """An append-only RecipeStore plus its recipe ids and tombstones.
+
+    Segments are never modified: tombstoned() returns a new Segment with
+    the same store and ids, so a change only becomes visible when the
+    index publishes a new segment tuple, and a search that already holds
+    the old tuple keeps seeing stable masks.
+    """
+
+    __slots__ = ('store', 'ids', 'deleted')
+
+    def __init__(self, store, ids, deleted=None):
+        self.store = store
+        self.ids = ids if isinstance(ids, list) else list(ids)
+        self.deleted = np.zeros(len(ids), dtype=bool) if deleted is None else deleted
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def live(self):
+        return len(self.ids) - int(self.deleted.sum())
+
+    def tombstoned(self, row):
+        deleted = self.deleted.copy()
+        deleted[row] = True
+        return Segment(self.store, self.ids, deleted)
+
+
+def _check_options(options):
+    if options.get('fusion') is not None:
+        raise ValueError("segmented search does not support BM25 fusion")
+    if options.get('reduce') is not None:
+        raise ValueError("segmented search does not support reduce")
+    if options.get('shards'):
+        # 每个段都会启动自己的工作进程, 而且 ShardedEngine 不支持墓碑掩码
+        raise ValueError("segmented search does not support shards")
+
+
+class SegmentedEngine:
+    """Read-only snapshot of a SegmentedIndex with the ScoringEngine search API.
+
+    Per-segment scores are merged directly, so only options whose scores
+    do not depend on the rest of the corpus are allowed: BM25 fusion
+    (per-segment statistics, max-normalisation and ranks) and reduce (a
+    projection fitted per segment puts the cosines in different spaces)
+    are rejected. So is shards: every segment would start its own worker
+    processes, and sharded engines cannot exclude tombstoned rows.
+    """
+
+    def __init__(self, segments, options):
+        _check_options(options)
+        self.segments = [(segment.store, segment.deleted) for segment in segments]
+        for store, _ in self.segments:
+            if store.engine_options != options:
+                store.engine_options = dict(options)
+                store.touch()
+
+    def __len__(self):
+        return sum(len(deleted) - int(deleted.sum()) for _, deleted in self.segments)
+
+    def search(self, query_embedding, parsed_query, k, min_similarity, filters=None):
+        return self.search_many(query_embedding, [parsed_query], k, min_similarity, filters)[0]
+
+    def search_many(self, query_embeddings, parsed_queries, k, min_similarity, filters=None):
+        per_segment = []
+        for store, deleted in self.segments:
+            excluded = deleted if deleted.any() else None
+            if filters:
+                # 每段各自的过滤掩码, 与墓碑合并
+                filtered = store.engine.filter_index.excluded(filters)
+                excluded = filtered if excluded is None else excluded | filtered
+            per_segment.append(store.engine.top_k_many(query_embeddings, parsed_queries, k, min_similarity,
+                                                       excluded=excluded))
+        results = []
+        for q, (attribute, _, _) in enumerate(parsed_queries):
+            # 各段的局部前 k 名用堆合并; 同分时按段顺序和行号, 与单个索引的稳定排序一致
+            candidates = (
+                (-score, seg_no, row)
+                for seg_no, ranked in enumerate(per_segment)
+                for row, score in zip(*ranked[q])
+            )
+            final_results = []
+            for _, seg_no, row in heapq.nsmallest(k, candidates):
+                value = self.segments[seg_no][0].results[attribute][row]
+                if value is not MISSING:
+                    final_results.append(value)
+            results.append(final_results or list(NO_MATCH))
+        return results
+
+
+class SegmentedIndex(VersionedIndex):
+    """Incrementally updatable index made of append-only segments.
+
+    add_recipes() encodes only the new recipes into a new small segment,
+    delete_recipe() tombstones a row and update_recipe() is a delete plus
+    an add under the same recipe id, published together in one swap of
+    the segment tuple. compact() merges all segments into one, dropping
+    tombstoned rows, without re-encoding anything. Once there are more
+    than max_segments segments, a background thread merges only the tail
+    of small segments (each no larger than MERGE_FACTOR times the merged
+    tail after it), so repeated small adds do not rewrite the corpus.
+    Searches never take the write lock and merge the per-segment top-k
+    with a heap.
+    """
+
+    def __init__(self, embedder, max_segments=8):
+        self._init_versioning()
+        self.embedder = embedder
+        self.max_segments = max_segments
+        self.segments = ()
+        self._locations = {}
+        self._next_id = itertools.count()
+        self._write_lock = threading.RLock()
+        self._compaction = None
+
+    @classmethod
+    def from_recipes(cls, embedder, recipes, **kwargs):
+        index = cls(embedder, **kwargs)
+        index.add_recipes(recipes)
+        return index
+
+    def __len__(self):
+        return sum(segment.live for segment in self.segments)
+
+    def _encode(self, recipes):
+        doc_embeddings = self.embedder.encode([document_text(r) for r in recipes], convert_to_numpy=True)
+        title_embeddings = self.embedder.encode([r['title'] for r in recipes], convert_to_numpy=True,
+                                                normalize_embeddings=True)
+        return doc_embeddings, title_embeddings
+
+    def _new_segment(self, recipes, ids):
+        """Encode recipes into a segment and record their locations; the caller publishes it"""
+        doc_embeddings, title_embeddings = self._encode(recipes)
+        segment = Segment(RecipeStore.from_recipes(recipes, doc_embeddings, title_embeddings), ids)
+        for row, recipe_id in enumerate(ids):
+            self._locations[recipe_id] = (segment.store, row)
+        if self.title_trie is not None:
+            for recipe in recipes:
+                self.title_trie.insert(recipe['title'])
+        return segment
+
+    def _tombstoned(self, segments, store, row):
+        """segments with the given row of the segment holding store tombstoned"""
+        return tuple(segment.tombstoned(row) if segment.store is store else segment for segment in segments)
+
+    def add_recipes(self, recipes):
+        """Encode and append recipes as a new segment; returns their recipe ids"""
+        recipes = list(recipes)
+        if not recipes:
+            return []
+        with self._write_lock:
+            ids = [next(self._next_id) for _ in recipes]
+            # 发布新的段元组是一次引用赋值, 读者不需要加锁
+            self.segments = self.segments + (self._new_segment(recipes, ids),)
+            self.touch()
+        self._maybe_compact()
+        return ids
+
+    def delete_recipe(self, recipe_id):
+        with self._write_lock:
+            store, row = self._locations.pop(recipe_id)
+            self.segments = self._tombstoned(self.segments, store, row)
+            self.touch()
+
+    def update_recipe(self, recipe_id, recipe):
+        with self._write_lock:
+            store, row = self._locations[recipe_id]
+            segment = self._new_segment([recipe], [recipe_id])
+            # 删除旧行和追加新段在同一次赋值中发布, 读者不会同时看到新旧两份
+            self.segments = self._tombstoned(self.segments, store, row) + (segment,)
+            self.touch()
+        self._maybe_compact()
+
+    def recipe(self, recipe_id):
+        store, row = self._locations[recipe_id]
+        return store.metadata(row)
+
+    @staticmethod
+    def tail_start(segments):
+        """Index of the first segment of the small tail that automatic compaction merges"""
+        start = len(segments) - 1
+        total = len(segments[start])
+        while start > 0 and len(segments[start - 1]) <= MERGE_FACTOR * total:
+            start -= 1
+            total += len(segments[start])
+        # 至少合并两个段, 否则段数不会减少
+        return max(0, min(start, len(segments) - 2))
+
+    def compact(self, tail_only=False):
+        """Merge all segments into one, dropping tombstoned rows.
+
+        tail_only=True merges only the segments from tail_start() on and
+        leaves the large head segments as they are.
+        """
+        with self._write_lock:
+            segments = self.segments
+            if len(segments) <= 1 and not any(s.deleted.any() for s in segments):
+                return
+            keep = segments[:self.tail_start(segments)] if tail_only else ()
+            segments = segments[len(keep):]
+            recipes, doc_rows, title_rows, ids = [], [], [], []
+            for segment in segments:
+                live = np.flatnonzero(~segment.deleted)
+                recipes.extend(segment.store.metadata(row) for row in live)
+                doc_rows.append(segment.store.doc_matrix[live])
+                title_rows.append(segment.store.title_matrix[live])
+                ids.extend(segment.ids[row] for row in live)
+            dim = segments[0].store.dim
+            merged = Segment(
+                RecipeStore.from_recipes(
+                    recipes,
+                    np.concatenate(doc_rows) if doc_rows else np.zeros((0, dim), dtype=np.float32),
+                    np.concatenate(title_rows) if title_rows else np.zeros((0, dim), dtype=np.float32),
+                ),
+                ids,
+            )
+            for row, recipe_id in enumerate(ids):
+                self._locations[recipe_id] = (merged.store, row)
+            self.segments = keep + ((merged,) if ids else ())
+            self.touch()
+
+    def compact_in_background(self, tail_only=False):
+        """Start compaction in a daemon thread unless one is already running"""
+        if self._compaction is not None and self._compaction.is_alive():
+            return self._compaction
+        self._compaction = threading.Thread(target=self.compact, args=(tail_only,), name='segment-compaction',
+                                            daemon=True)
+        self._compaction.start()
+        return self._compaction
+
+    def _maybe_compact(self):
+        if len(self.segments) > self.max_segments:
+            self.compact_in_background(tail_only=True)
+
+    def configure(self, **options):
+        # 在配置时就拒绝不支持的选项, 而不是等到第一次查询
+        _check_options(options)
+        super().configure(**options)
+
+    def build_engine(self, **options):
+        return SegmentedEngine(self.segments, options)
@@ -0,0 +1,337 @@
+import asyncio
+import json
+import numbers
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from hot_index import IndexHolder, ReloadError
+from search_function import search_requests
+
+# 收集请求的默认时间窗和每批最大查询数
+BATCH_WINDOW = 0.002
+MAX_BATCH = 32
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+            500: 'Internal Server Error'}
+
+
+class BatchStats:
+    """Query/batch counters, throughput and a power-of-two batch-size histogram"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.batches = 0
+        self.histogram = {}
+        self.busy_seconds = 0.0
+
+    def record(self, size, seconds):
+        self.queries += size
+        self.batches += 1
+        self.busy_seconds += seconds
+        bucket = 1
+        while bucket < size:
+            bucket *= 2
+        self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+
+    def snapshot(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            'queries': self.queries,
+            'batches': self.batches,
+            'mean_batch_size': self.queries / self.batches if self.batches else 0.0,
+            'queries_per_second': self.queries / elapsed if elapsed > 0 else 0.0,
+            'busy_seconds': self.busy_seconds,
+            # 键为桶的上界: 2 表示 2 个查询, 4 表示 3-4 个, 依此类推
+            'batch_size_histogram': {str(bucket): n for bucket, n in sorted(self.histogram.items())},
+        }
+
+
+class MicroBatcher:
+    """Collects concurrent search requests and answers them in batches.
+
+    The first pending request opens a window; the batch is dispatched when
+    max_batch requests are queued or window seconds have passed. Each batch
+    is one search_requests() call (one encode, one GEMM per distinct k and
+    min_similarity) run in a worker thread, so the event loop keeps
+    accepting requests while it scores. vector_store may be an IndexHolder;
+    each batch then runs on the snapshot that is current when it starts.
+    If a batch raises, its requests are retried one by one so that only
+    the failing request gets the exception.
+    """
+
+    def __init__(self, embedder, vector_store, window=BATCH_WINDOW, max_batch=MAX_BATCH):
+        self.embedder = embedder
+        self.vector_store = vector_store
+        self.window = window
+        self.max_batch = max_batch
+        self.stats = BatchStats()
+        self._queue = None
+        self._task = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='search-batch')
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._executor.shutdown(wait=True)
+
+    async def search(self, query, k, min_similarity):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(((query, k, min_similarity), future))
+        return await future
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.window
+        while len(batch) < self.max_batch:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # 时间窗结束后已排队的请求也一起带上
+        while len(batch) < self.max_batch and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    def current_store(self):
+        store = self.vector_store
+        return store.snapshot if isinstance(store, IndexHolder) else store
+
+    def _score(self, requests):
+        """(results, seconds); a result is the exception if that request failed"""
+        start = time.perf_counter()
+        store = self.current_store()
+        try:
+            results = search_requests(self.embedder, store, requests)
+        except Exception:
+            # 整批失败时逐个重试, 只让出错的请求失败
+            results = []
+            for request in requests:
+                try:
+                    results.append(search_requests(self.embedder, store, [request])[0])
+                except Exception as exc:
+                    results.append(exc)
+        return results, time.perf_counter() - start
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            requests = [request for request, _ in batch]
+            try:
+                results, seconds = await loop.run_in_executor(self._executor, self._score, requests)
+            except Exception as exc:
+                results, seconds = [exc] * len(batch), 0.0
+            failed = sum(isinstance(result, Exception) for result in results)
+            self.stats.record(len(batch), seconds)
+            if isinstance(self.vector_store, IndexHolder):
+                self.vector_store.record_queries(len(batch), dropped=failed)
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+
+class SearchService:
+    """Minimal HTTP/1.1 JSON server around a MicroBatcher.
+
+    POST /search  {"query": str, "k": int = 3, "min_similarity": float = 0.8}
+                  -> {"results": [...]}
+    GET  /stats   -> batching (and index reload) statistics
+    GET  /health  -> {"status": "ok"}
+    POST /reload  -> rebuild and swap the index (IndexHolder only)
+    """
+
+    def __init__(self, batcher, host='127.0.0.1', port=8080):
+        self.batcher = batcher
+        self.host = host
+        self.port = port
+        self.server = None
+
+    async def start(self):
+        self.batcher.start()
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        await self.batcher.close()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                status, payload = await self._dispatch(method, path, body)
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                writer.write(
+                    f"HTTP/1.1 {status} {_REASONS[status]}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode('latin-1') + data
+                )
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method, path, body):
+        if path == '/health':
+            return 200, {'status': 'ok'}
+        holder = self.batcher.vector_store if isinstance(self.batcher.vector_store, IndexHolder) else None
+        if path == '/stats':
+            stats = self.batcher.stats.snapshot()
+            if holder is not None:
+                stats['index'] = dict(holder.metrics)
+            return 200, stats
+        if path == '/reload' and holder is not None:
+            if method != 'POST':
+                return 405, {'error': 'use POST'}
+            try:
+                # 在线程中重建, 期间事件循环照常处理查询
+                await asyncio.get_running_loop().run_in_executor(None, holder.reload)
+            except ReloadError as exc:
+                return 500, {'error': str(exc)}
+            return 200, {'status': 'reloaded', 'seconds': holder.metrics['last_reload_seconds']}
+        if path != '/search':
+            return 404, {'error': f'unknown path {path}'}
+        if method != 'POST':
+            return 405, {'error': 'use POST'}
+        try:
+            request = json.loads(body or b'{}')
+            query = request['query']
+            k = request.get('k', 3)
+            min_similarity = request.get('min_similarity', 0.8)
+        except (ValueError, KeyError, TypeError, AttributeError) as exc:
+            return 400, {'error': f'bad request: {exc!r}'}
+        # 先校验类型, 坏请求不能进入批次
+        if not isinstance(query, str):
+            return 400, {'error': "bad request: 'query' must be a string"}
+        if isinstance(k, bool) or not isinstance(k, int) or k < 0:
+            return 400, {'error': "bad request: 'k' must be an integer >= 0"}
+        if isinstance(min_similarity, bool) or not isinstance(min_similarity, numbers.Real):
+            return 400, {'error': "bad request: 'min_similarity' must be a number"}
+        try:
+            results = await self.batcher.search(query, k, float(min_similarity))
+        except Exception as exc:
+            return 500, {'error': f'search failed: {exc!r}'}
+        return 200, {'results': results}
+
+
+async def _post(connection, payload):
+    reader, writer = connection
+    data = json.dumps(payload).encode('utf-8')
+    writer.write(
+        f"POST /search HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(data)}\r\n\r\n".encode('latin-1') + data
+    )
+    await writer.drain()
+    await reader.readline()
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        if line.lower().startswith(b'content-length:'):
+            length = int(line.split(b':')[1])
+    return json.loads(await reader.readexactly(length))
+
+
+async def benchmark(n_clients=64, n_requests=2000, window=BATCH_WINDOW, max_batch=MAX_BATCH):
+    """Load-test the service with the offline hashing embedder.
+
+    Every response is checked against a direct search() call, and the
+    micro-batched throughput is compared with the same service answering
+    each request on its own.
+    """
+    from caches import search_result_cache
+    from embedders import HashingEmbedder
+    from search_function import build_vector_store, get_recipe_data, search, test_cases
+
+    embedder = HashingEmbedder()
+    store = build_vector_store(embedder, get_recipe_data())
+    # 各不相同的查询, 避免结果缓存掩盖打分开销
+    titles = list(store.columns['title'])
+    suffixes = ['', ' ingredients', ' instructions', ' notes', ' serving size']
+    queries = [f"{titles[i % len(titles)].lower()} {i}{suffixes[i % len(suffixes)]}" for i in range(n_requests)]
+    queries[:len(test_cases)] = [query for query, _, _, _ in test_cases]
+
+    search_result_cache.clear()
+    start = time.perf_counter()
+    expected = [search(embedder, store, query, k=3, min_similarity=0.8) for query in queries]
+    print(f"{'in-process search()':>22}: {n_requests / (time.perf_counter() - start):8.1f} queries/s")
+
+    mismatches = 0
+    # max_batch=1 为不合批的对照: 每个 HTTP 请求单独 encode 和打分
+    for label, config in (('service, no batching', (0.0, 1)), ('service, micro-batched', (window, max_batch))):
+        search_result_cache.clear()
+        service = await SearchService(MicroBatcher(embedder, store, *config), port=0).start()
+        responses = [None] * n_requests
+
+        async def client(worker):
+            connection = await asyncio.open_connection('127.0.0.1', service.port)
+            for i in range(worker, n_requests, n_clients):
+                payload = {'query': queries[i], 'k': 3, 'min_similarity': 0.8}
+                responses[i] = (await _post(connection, payload))['results']
+            connection[1].close()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client(worker) for worker in range(n_clients)))
+        rate = n_requests / (time.perf_counter() - start)
+        stats = service.batcher.stats.snapshot()
+        await service.close()
+
+        wrong = sum(response != reference for response, reference in zip(responses, expected))
+        mismatches += wrong
+        print(f"{label:>22}: {rate:8.1f} queries/s, {n_clients} clients, {stats['batches']} batches, "
+              f"histogram {stats['batch_size_histogram']}, {wrong} mismatches vs search()")
+    return mismatches
+
+
+async def serve(host, port, window=BATCH_WINDOW, max_batch=MAX_BATCH):
+    from search_function import get_embedder, index_model_name
+
+    # 监视 recipes.json, preprocess.py 重新生成后自动热加载
+    holder = IndexHolder(get_embedder(), index_model_name())
+    holder.reload()
+    holder.watch()
+    service = await SearchService(MicroBatcher(holder.embedder, holder, window, max_batch), host, port).start()
+    print(f"serving on http://{host}:{service.port} (window {window * 1000:.1f} ms, max batch {max_batch})")
+    await service.server.serve_forever()
+
+
+if __name__ == '__main__':
+    # 用法: python src/test/service.py [port]   或   python src/test/service.py --bench
+    if '--bench' in sys.argv[1:]:
+        sys.exit(1 if asyncio.run(benchmark()) else 0)
+    asyncio.run(serve('127.0.0.1', int(sys.argv[1]) if len(sys.argv) > 1 else 8080))
@@ -0,0 +1,205 @@
+import heapq
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import weakref
+
+import numpy as np
+
+from engine import ScoringEngine, format_results, normalize_rows
+from projection import PROJECTIONS
+
+
+def _shard_worker(conn, doc_matrix, title_matrix, titles, offset, options):
+    # 每个工作进程只持有自己那一段行, 结果行号加上 offset 变成全局行号
+    engine = ScoringEngine(doc_matrix, title_matrix, [{'title': title} for title in titles],
+                           columns={}, normalized=True, **options)
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        query_embeddings, parsed_queries, k, min_similarity = message
+        ranked = engine.top_k_many(query_embeddings, parsed_queries, k, min_similarity)
+        conn.send([(indices + offset, scores) for indices, scores in ranked])
+    conn.close()
+
+
+def _shutdown(workers):
+    for conn, process in workers:
+        try:
+            conn.send(None)
+            conn.close()
+        except (OSError, ValueError):
+            pass
+        process.join(timeout=5)
+        if process.is_alive():
+            process.terminate()
+
+
+def shard_bounds(n, n_shards):
+    """Contiguous [start, stop) row ranges of nearly equal size"""
+    edges = np.linspace(0, n, n_shards + 1).astype(int)
+    return list(zip(edges[:-1], edges[1:]))
+
+
+class ShardedEngine:
+    """Scatter-gather search over row shards held by worker processes.
+
+    Each worker scores its contiguous slice of the matrices (dense scores,
+    title boost, min_similarity, local top k) and returns global row ids
+    with scores. The coordinator merges the per-shard lists with a heap,
+    breaking ties by row id like the single-process stable sort, then
+    formats the attribute columns, so results are identical to
+    ScoringEngine. BM25 fusion needs corpus-wide statistics and is not
+    supported, and neither are metadata filters. A reduce projection is
+    fitted once here on the whole corpus; workers get the projected rows
+    and the coordinator projects the queries.
+
+    Each scatter-gather round holds a lock, so concurrent searches never
+    read each other's replies from the worker pipes. If a worker has
+    died, all workers are restarted and the round is retried once.
+    """
+
+    def __init__(self, doc_matrix, title_matrix, titles, columns, n_shards=None, **options):
+        if options.get('fusion') is not None:
+            raise ValueError("sharded search does not support BM25 fusion")
+        options.pop('fusion', None)
+        reduce = options.pop('reduce', None)
+        reduce_dim = options.pop('reduce_dim', 128)
+        if reduce not in (None, *PROJECTIONS):
+            raise ValueError(f"unknown reduce mode: {reduce!r}")
+        # 建库时已降维的索引: 矩阵已投影, 只需投影查询
+        self.projection = options.pop('projection', None)
+        if reduce is not None and self.projection is not None:
+            raise ValueError("the index is already reduced; reduce cannot be applied again")
+        if reduce is not None and len(doc_matrix):
+            # 每个分片各自拟合会得到不同的投影, 所以在这里对全量矩阵拟合一次
+            doc_matrix, title_matrix = normalize_rows(doc_matrix), normalize_rows(title_matrix)
+            self.projection = PROJECTIONS[reduce](np.concatenate([doc_matrix, title_matrix]), reduce_dim)
+            doc_matrix = normalize_rows(self.projection.transform(doc_matrix))
+            title_matrix = normalize_rows(self.projection.transform(title_matrix))
+        self.columns = columns
+        self.n_rows = len(doc_matrix)
+        # 保留启动参数, 工作进程退出后可以重新启动
+        self._shard_args = (doc_matrix, title_matrix, titles, options,
+                            max(1, min(n_shards or os.cpu_count() or 1, self.n_rows or 1)))
+        self._lock = threading.Lock()
+        self.workers = []
+        self._start_workers()
+        self._finalizer = weakref.finalize(self, _shutdown, self.workers)
+
+    def _start_workers(self):
+        doc_matrix, title_matrix, titles, options, n_shards = self._shard_args
+        context = multiprocessing.get_context()
+        workers = []
+        for start, stop in shard_bounds(self.n_rows, n_shards):
+            parent, child = context.Pipe()
+            process = context.Process(
+                target=_shard_worker,
+                args=(child, np.ascontiguousarray(doc_matrix[start:stop]),
+                      np.ascontiguousarray(title_matrix[start:stop]), list(titles[start:stop]), start, options),
+                daemon=True,
+            )
+            process.start()
+            child.close()
+            workers.append((parent, process))
+        # 原地替换, finalizer 持有的是同一个列表
+        self.workers[:] = workers
+
+    def _scatter_gather(self, message):
+        for conn, _ in self.workers:
+            conn.send(message)
+        return [conn.recv() for conn, _ in self.workers]
+
+    @classmethod
+    def from_store(cls, store, n_shards=None, **options):
+        return cls(store.doc_matrix, store.title_matrix, store.columns['title'], store.results, n_shards, **options)
+
+    @property
+    def n_shards(self):
+        return len(self.workers)
+
+    def __len__(self):
+        return self.n_rows
+
+    def close(self):
+        self._finalizer()
+
+    def top_k_many(self, query_embeddings, parsed_queries, k, min_similarity):
+        query_embeddings = np.asarray(query_embeddings, dtype=np.float32).reshape(len(parsed_queries), -1)
+        if self.projection is not None:
+            query_embeddings = normalize_rows(self.projection.transform(normalize_rows(query_embeddings)))
+        message = (query_embeddings, parsed_queries, k, min_similarity)
+        # 一次完整的发送+接收在锁内完成, 并发查询不会读到别人的回复
+        with self._lock:
+            try:
+                per_shard = self._scatter_gather(message)
+            except (EOFError, OSError):
+                # 有工作进程退出 (BrokenPipeError 是 OSError): 全部重启后重试一次
+                _shutdown(list(self.workers))
+                self._start_workers()
+                per_shard = self._scatter_gather(message)
+        ranked = []
+        for q in range(len(parsed_queries)):
+            candidates = (
+                (-score, row)
+                for shard in per_shard
+                for row, score in zip(*shard[q])
+                if score >= min_similarity
+            )
+            best = heapq.nsmallest(k, candidates)
+            ranked.append((np.array([row for _, row in best], dtype=np.intp),
+                           np.array([-score for score, _ in best], dtype=np.float64)))
+        return ranked
+
+    def search(self, query_embedding, parsed_query, k, min_similarity, filters=None):
+        return self.search_many(query_embedding, [parsed_query], k, min_similarity, filters)[0]
+
+    def search_many(self, query_embeddings, parsed_queries, k, min_similarity, filters=None):
+        if filters:
+            # 工作进程只持有标题, 没有过滤所需的元数据
+            raise ValueError("sharded search does not support filters")
+        ranked = self.top_k_many(query_embeddings, parsed_queries, k, min_similarity)
+        return [
+            format_results(self.columns, indices, attribute)
+            for (indices, _), (attribute, _, _) in zip(ranked, parsed_queries)
+        ]
+
+
+def benchmark(n=200000, n_queries=512, batch=32, k=3, shard_counts=None, dim=384, seed=0):
+    """Queries/s of ScoringEngine vs ShardedEngine on a synthetic corpus, checking identical results"""
+    from ann import synthetic_vectors
+    from engine import parse_query, result_columns
+
+    vectors = synthetic_vectors(2 * n + n_queries, dim=dim, seed=seed)
+    doc_matrix, title_matrix, queries = vectors[:n], vectors[n:2 * n], vectors[2 * n:]
+    metadatas = [{'title': f"RECIPE {i}", 'ingredients': f"{i} cups", 'instructions': '', 'notes': '',
+                  'serving_size': [i % 12, i % 12]} for i in range(n)]
+    titles = [m['title'] for m in metadatas]
+    columns = result_columns(metadatas)
+    words = ['recipe', 'cups', 'cake ingredients', 'pie notes', 'bread serving size']
+    parsed = [parse_query(f"{words[i % len(words)]} {i}") for i in range(n_queries)]
+
+    def run(engine):
+        start = time.perf_counter()
+        results = []
+        for i in range(0, n_queries, batch):
+            results += engine.search_many(queries[i:i + batch], parsed[i:i + batch], k, 0.0)
+        return n_queries / (time.perf_counter() - start), results
+
+    single_rate, expected = run(ScoringEngine(doc_matrix, title_matrix, metadatas, columns=columns, normalized=True))
+    print(f"cpus {os.cpu_count()}, corpus {n} x {dim}, {n_queries} queries in batches of {batch}")
+    print(f"{'engine':>10} {'queries/s':>10} {'speedup':>8} {'identical':>9}")
+    print(f"{'single':>10} {single_rate:>10.1f} {1.0:>8.2f} {'-':>9}")
+    for n_shards in shard_counts or sorted({1, 2, 4, os.cpu_count() or 1}):
+        engine = ShardedEngine(doc_matrix, title_matrix, titles, columns, n_shards)
+        rate, results = run(engine)
+        engine.close()
+        print(f"{str(n_shards) + ' shards':>10} {rate:>10.1f} {rate / single_rate:>8.2f} {str(results == expected):>9}")
+
+
+if __name__ == '__main__':
+    # 用法: python src/test/sharded.py [n]
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,294 @@
+import atexit
+import fcntl
+import json
+import os
+import struct
+import sys
+import tempfile
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from projection import LinearProjection
+from recipe_store import RecipeStore
+from title_trie import TitleTrie
+
+# 控制块: 引用计数 (int64) + 头部长度 (int64) + JSON 头部
+CONTROL_SIZE = 1 << 16
+_COUNTS = struct.Struct('<qq')
+ALIGN = 64
+
+
+def _attach(name):
+    """Open an existing block without letting this process's resource tracker unlink it at exit"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 没有 track 参数: 手动取消登记, 否则工作进程退出时会删掉共享内存
+        block = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(block._name, 'shared_memory')
+        return block
+
+
+class _RefLock:
+    """Cross-process lock on a per-index lock file (flock)"""
+
+    def __init__(self, name):
+        self.path = os.path.join(tempfile.gettempdir(), f"{name}.lock")
+
+    def __enter__(self):
+        self._file = open(self.path, 'a+b')
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+
+
+class SharedIndex:
+    """A RecipeStore whose matrices and packed metadata live in shared memory.
+
+    The loader calls create(store, name) once; every worker calls
+    attach(name) and gets a RecipeStore whose doc/title matrices are
+    zero-copy views of the same pages, so resident memory does not grow
+    with the number of workers. A reference count in the control block
+    (guarded by a file lock) tracks creator plus attached workers, and
+    the last close() (or exit of the last attached process) unlinks the
+    blocks. Metadata is stored as one JSON
+    blob and decoded per process; it is small next to the matrices.
+    """
+
+    def __init__(self, name, control, data, header):
+        self.name = name
+        self._control = control
+        self._data = data
+        self.header = header
+        self.store = self._build_store()
+        self.closed = False
+        # 进程正常退出时也归还引用, 否则最后一个引用永远不会归零
+        atexit.register(self.close)
+
+    @staticmethod
+    def block_names(name):
+        return f"{name}-ctl", f"{name}-data"
+
+    @classmethod
+    def create(cls, store, name=None):
+        if not isinstance(store, RecipeStore):
+            store = RecipeStore.from_vector_store(store)
+        name = name or f"recipes-{os.getpid()}-{time.monotonic_ns():x}"
+        recipes = [store.metadata(i) for i in range(len(store))]
+        arrays = {'doc': store.doc_matrix, 'title': store.title_matrix}
+        header = {'count': len(store), 'dim': store.dim}
+        trie = store.title_trie
+        if trie is not None and trie.model is not None:
+            # 行顺序的矩阵放进数据块, 键由标题推出; 头部大小与语料无关
+            arrays['title_queries'] = trie.row_embeddings(store.columns['title'])
+            header['title_queries'] = {'model': trie.model}
+        if store.projection is not None:
+            # 降维索引: 投影矩阵也放进共享内存, 工作进程用它投影查询
+            arrays['projection'] = store.projection.components
+            header['projection'] = store.projection.mode
+        meta = json.dumps(recipes, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+        # 各段按 64 字节对齐依次放进同一个数据块
+        layout, offset = {}, 0
+        for key, array in arrays.items():
+            array = np.ascontiguousarray(array, dtype=np.float32)
+            arrays[key] = array
+            layout[key] = {'offset': offset, 'shape': list(array.shape)}
+            offset += -(-array.nbytes // ALIGN) * ALIGN
+        layout['metadata'] = {'offset': offset, 'size': len(meta)}
+        header['layout'] = layout
+        blob = json.dumps(header).encode('utf-8')
+        if _COUNTS.size + len(blob) > CONTROL_SIZE:
+            raise ValueError("shared index header is too large")
+
+        ctl_name, data_name = cls.block_names(name)
+        data = shared_memory.SharedMemory(name=data_name, create=True, size=max(1, offset + len(meta)))
+        control = shared_memory.SharedMemory(name=ctl_name, create=True, size=CONTROL_SIZE)
+        # 创建者负责最终 unlink, 不交给 resource tracker
+        for block in (data, control):
+            resource_tracker.unregister(block._name, 'shared_memory')
+        for key, array in arrays.items():
+            view = np.ndarray(array.shape, dtype=np.float32, buffer=data.buf, offset=layout[key]['offset'])
+            view[...] = array
+            del view
+        data.buf[offset:offset + len(meta)] = meta
+        control.buf[_COUNTS.size:_COUNTS.size + len(blob)] = blob
+        _COUNTS.pack_into(control.buf, 0, 1, len(blob))
+        return cls(name, control, data, header)
+
+    @classmethod
+    def attach(cls, name):
+        ctl_name, data_name = cls.block_names(name)
+        with _RefLock(name):
+            control = _attach(ctl_name)
+            refs, size = _COUNTS.unpack_from(control.buf, 0)
+            if refs <= 0:
+                control.close()
+                raise FileNotFoundError(f"shared index {name!r} is being torn down")
+            _COUNTS.pack_into(control.buf, 0, refs + 1, size)
+        header = json.loads(bytes(control.buf[_COUNTS.size:_COUNTS.size + size]))
+        return cls(name, control, _attach(data_name), header)
+
+    @property
+    def refcount(self):
+        return _COUNTS.unpack_from(self._control.buf, 0)[0]
+
+    def _array(self, key):
+        spec = self.header['layout'][key]
+        array = np.ndarray(tuple(spec['shape']), dtype=np.float32, buffer=self._data.buf, offset=spec['offset'])
+        array.flags.writeable = False
+        return array
+
+    def _build_store(self):
+        spec = self.header['layout']['metadata']
+        recipes = json.loads(bytes(self._data.buf[spec['offset']:spec['offset'] + spec['size']]))
+        store = RecipeStore.from_matrices(recipes, self._array('doc'), self._array('title'))
+        if 'projection' in self.header:
+            store.projection = LinearProjection(self._array('projection'), self.header['projection'])
+        title_queries = self.header.get('title_queries')
+        if title_queries:
+            store.title_trie = TitleTrie.from_embeddings(
+                (recipe['title'] for recipe in recipes), self._array('title_queries'), title_queries['model'],
+            )
+        return store
+
+    def close(self):
+        """Drop this process's reference; the last one unlinks the shared blocks"""
+        if self.closed:
+            return
+        self.closed = True
+        atexit.unregister(self.close)
+        # 先释放指向共享内存的 numpy 视图, 否则 mmap 无法关闭
+        self.store = None
+        with _RefLock(self.name):
+            refs, size = _COUNTS.unpack_from(self._control.buf, 0)
+            refs -= 1
+            _COUNTS.pack_into(self._control.buf, 0, refs, size)
+        for block in (self._data, self._control):
+            try:
+                block.close()
+            except BufferError:
+                # 其他地方仍引用着视图: 映射在进程退出时释放
+                pass
+        if refs == 0:
+            for block in (self._data, self._control):
+                # unlink() 会向 resource tracker 注销, 先登记回去以免它报 KeyError
+                resource_tracker.register(block._name, 'shared_memory')
+                block.unlink()
+            try:
+                os.unlink(_RefLock(self.name).path)
+            except FileNotFoundError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _memory_kb():
+    """(PSS, shared-memory PSS) of this process in kB.
+
+    PSS splits each shared page among the processes mapping it, so the sum
+    over processes is their real combined footprint.
+    """
+    values = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            key, _, rest = line.partition(':')
+            if key in ('Pss', 'Pss_Shmem'):
+                values[key] = int(rest.split()[0])
+    return values.get('Pss', 0), values.get('Pss_Shmem', 0)
+
+
+def _worker(name, shared, queue, barrier):
+    from caches import search_result_cache
+    from embedders import HashingEmbedder
+    from search_function import search
+
+    embedder = HashingEmbedder()
+    if shared:
+        index = SharedIndex.attach(name)
+        store = index.store
+    else:
+        # 对照: 每个进程各自持有一份矩阵
+        index = SharedIndex.attach(name)
+        store = RecipeStore.from_recipes(index.store.metadatas()[:], np.array(index.store.doc_matrix),
+                                         np.array(index.store.title_matrix))
+        index.close()
+    for title in list(store.columns['title'])[:50]:
+        search_result_cache.clear()
+        search(embedder, store, title.lower(), k=3, min_similarity=0.5)
+    # 所有工作进程都载入完毕后再测量, PSS 才能反映共享页的分摊
+    barrier.wait()
+    queue.put(_memory_kb())
+    barrier.wait()
+    if shared:
+        store = None
+        index.close()
+
+
+def benchmark(n=50000, worker_counts=(1, 2, 4), dim=384):
+    """Sum of worker PSS for shared vs per-process matrices as workers are added.
+
+    Each worker also builds its own per-process structures from the
+    metadata (title n-gram index, result columns), which still grow with
+    the number of workers; the "of it shm" column is the matrix part.
+    """
+    import multiprocessing
+
+    from ann import synthetic_vectors
+
+    vectors = synthetic_vectors(2 * n, dim=dim)
+    recipes = [{'title': f"RECIPE {i}", 'serving_size': [4, 4], 'notes': '', 'ingredients': f"{i % 7} cups",
+                'instructions': 'Mix.'} for i in range(n)]
+    store = RecipeStore.from_matrices(recipes, vectors[:n], vectors[n:])
+    context = multiprocessing.get_context('spawn')
+    print(f"corpus {n} x {dim}: {2 * vectors[:n].nbytes / 2**20:.0f} MiB of matrices")
+    print(f"{'mode':>8} {'workers':>7} {'sum PSS MiB':>11} {'of it shm':>9} {'PSS/worker':>10}")
+    with SharedIndex.create(store) as index:
+        for shared in (True, False):
+            for n_workers in worker_counts:
+                queue, barrier = context.Queue(), context.Barrier(n_workers)
+                workers = [context.Process(target=_worker, args=(index.name, shared, queue, barrier))
+                           for _ in range(n_workers)]
+                for worker in workers:
+                    worker.start()
+                usage = [queue.get() for _ in workers]
+                for worker in workers:
+                    worker.join()
+                pss = sum(p for p, _ in usage) / 1024
+                shm = sum(s for _, s in usage) / 1024
+                print(f"{'shared' if shared else 'private':>8} {n_workers:>7} {pss:>11.0f} {shm:>9.0f} "
+                      f"{pss / n_workers:>10.0f}")
+        print(f"references left after workers exit: {index.refcount}")
+
+
+def publish(name):
+    """Loader process: put the default vector store in shared memory until interrupted"""
+    import signal
+
+    from search_function import get_vector_store
+
+    with SharedIndex.create(get_vector_store(), name) as index:
+        print(f"published {len(index.store)} recipes as {name!r}; "
+              f"start workers with RECIPE_SHARED_INDEX={name}")
+        signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+        try:
+            signal.pause()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    # 用法: python src/test/shared_store.py [n]   或   python src/test/shared_store.py --publish NAME
+    if sys.argv[1:2] == ['--publish']:
+        publish(sys.argv[2] if len(sys.argv) > 2 else 'recipes')
+    else:
+        benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
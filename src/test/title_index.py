@@ -0,0 +1,63 @@
+from collections import defaultdict
+
+import numpy as np
+
+# 建索引时保存的最长字符 n-gram; 更长的词元用多个 n-gram 求交集后再校验
+MAX_GRAM = 3
+
+
+class TitleTokenIndex:
+    """Character n-gram index over lower-cased titles.
+
+    Answers "which titles contain this token as a substring" (the same
+    test as ``token in title.lower()``) in time proportional to the
+    postings touched rather than to the corpus size.
+    """
+
+    def __init__(self, titles):
+        self.titles_lower = [title.lower() for title in titles]
+        postings = defaultdict(set)
+        for doc_id, title in enumerate(self.titles_lower):
+            for n in range(1, MAX_GRAM + 1):
+                for start in range(len(title) - n + 1):
+                    postings[title[start:start + n]].add(doc_id)
+        self.postings = {
+            gram: np.array(sorted(ids), dtype=np.intp) for gram, ids in postings.items()
+        }
+
+    def __len__(self):
+        return len(self.titles_lower)
+
+    def lookup(self, token):
+        """Sorted ids of the titles that contain token"""
+        empty = np.empty(0, dtype=np.intp)
+        if not token:
+            return np.arange(len(self.titles_lower), dtype=np.intp)
+        if len(token) <= MAX_GRAM:
+            return self.postings.get(token, empty)
+
+        # 取各 n-gram 的倒排表求交集, 从最短的开始
+        grams = {token[i:i + MAX_GRAM] for i in range(len(token) - MAX_GRAM + 1)}
+        lists = sorted((self.postings.get(gram, empty) for gram in grams), key=len)
+        candidates = lists[0]
+        for ids in lists[1:]:
+            if not candidates.size:
+                break
+            candidates = np.intersect1d(candidates, ids, assume_unique=True)
+        # n-gram 命中不代表整串命中, 逐个校验
+        return np.array(
+            [i for i in candidates if token in self.titles_lower[i]], dtype=np.intp
+        )
+
+    def match_counts(self, query_tokens):
+        """Sparse (doc_ids, counts) of query tokens found in each title"""
+        hits = {}
+        for token in query_tokens:
+            if token not in hits:
+                hits[token] = self.lookup(token)
+        # 重复的词元按原实现重复计数
+        matched = [hits[token] for token in query_tokens]
+        if not matched:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float64)
+        doc_ids, counts = np.unique(np.concatenate(matched), return_counts=True)
+        return doc_ids, counts.astype(np.float64)
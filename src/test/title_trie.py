@@ -0,0 +1,124 @@
+import numpy as np
+
+from caches import model_key, normalize_query
+
+
+class _Node:
+    __slots__ = ('children', 'titles', 'embedding', 'order')
+
+    def __init__(self):
+        self.children = {}
+        self.titles = None      # 以此结点结尾的原始标题
+        self.embedding = None   # 该标题作为查询时的向量
+        self.order = None       # 按逆字典序排好的子结点, 插入时失效
+
+    def reversed_children(self):
+        if self.order is None:
+            self.order = [self.children[ch] for ch in sorted(self.children, reverse=True)]
+        return self.order
+
+
+class TitleTrie:
+    """Prefix trie over normalized recipe titles.
+
+    complete() serves autocomplete. When built with an embedder, every
+    terminal node also keeps the query embedding of its normalized title,
+    so an exact-title query can skip the encoder and still score exactly
+    like the dense path does.
+    """
+
+    def __init__(self):
+        self.root = _Node()
+        self.model = None
+
+    @classmethod
+    def build(cls, titles, embedder=None, model=None):
+        trie = cls()
+        titles = list(titles)
+        for title in titles:
+            trie.insert(title)
+        if embedder is not None:
+            keys = sorted({normalize_query(title) for title in titles})
+            if keys:
+                # 编码的文本与 search() 对该查询编码的 base_query 完全相同
+                embeddings = embedder.encode(keys, convert_to_numpy=True)
+                for key, embedding in zip(keys, embeddings):
+                    trie._find(key).embedding = np.asarray(embedding, dtype=np.float32)
+            trie.model = model if model is not None else model_key(embedder)
+        return trie
+
+    @classmethod
+    def from_embeddings(cls, titles, embeddings, model):
+        """Rebuild a trie from titles plus their query embeddings in the same order (see row_embeddings())"""
+        titles = list(titles)
+        trie = cls()
+        for title in titles:
+            trie.insert(title)
+        # NaN 行表示该标题没有预先编码的向量
+        stored = ~np.isnan(embeddings[:, 0]) if embeddings.size else np.zeros(len(titles), dtype=bool)
+        for title, embedding, present in zip(titles, embeddings, stored):
+            if present:
+                trie._find(normalize_query(title)).embedding = embedding
+        trie.model = model
+        return trie
+
+    def row_embeddings(self, titles):
+        """Stored query embedding of every title, in the given order; NaN rows for titles without one.
+
+        Keys are not saved: from_embeddings() derives them from the titles,
+        so the saved data is one matrix row per recipe and nothing else.
+        """
+        nodes = [self._find(normalize_query(title)) for title in titles]
+        dim = next((len(node.embedding) for node in nodes if node is not None and node.embedding is not None), 0)
+        matrix = np.full((len(nodes), dim), np.nan, dtype=np.float32)
+        for row, node in enumerate(nodes):
+            if node is not None and node.embedding is not None:
+                matrix[row] = node.embedding
+        return matrix
+
+    def insert(self, title):
+        node = self.root
+        for ch in normalize_query(title):
+            child = node.children.get(ch)
+            if child is None:
+                child = node.children[ch] = _Node()
+                node.order = None
+            node = child
+        if node.titles is None:
+            node.titles = []
+        if title not in node.titles:
+            node.titles.append(title)
+
+    def _find(self, key):
+        node = self.root
+        for ch in key:
+            node = node.children.get(ch)
+            if node is None:
+                return None
+        return node
+
+    def __contains__(self, title):
+        node = self._find(normalize_query(title))
+        return node is not None and node.titles is not None
+
+    def complete(self, prefix, n=10):
+        """Up to n titles starting with prefix, in alphabetical order of their normalized form"""
+        node = self._find(normalize_query(prefix))
+        results = []
+        if node is None or n <= 0:
+            return results
+        stack = [node]
+        while stack and len(results) < n:
+            node = stack.pop()
+            if node.titles:
+                results.extend(node.titles[:n - len(results)])
+            # 反序压栈, 使字典序小的子结点先出栈
+            stack.extend(node.reversed_children())
+        return results
+
+    def query_embedding(self, embedder, base_query):
+        """Stored embedding for an exact-title base_query, or None"""
+        if self.model is None or self.model != model_key(embedder):
+            return None
+        node = self._find(normalize_query(base_query))
+        return None if node is None else node.embedding